@@ -0,0 +1,100 @@
+"""
+Сохранение отправленных курсов после рассылки: UPDATE на каждого подписчика
+(update_last_course_data) против итогов пачек outbox (complete_outbox), которые
+записывает OutboxWorker: статус сообщений и last_course_data одним запросом на пачку.
+
+Нужна настроенная БД (.env). Создает временных пользователей с id от 9·10^12
+и удаляет их после замера.
+
+Запуск: python -m benchmarks.broadcast_updates [--users 5000] [--concurrency 20]
+"""
+import argparse
+import asyncio
+import time
+
+from database.db import complete_outbox, create_db_pool, enqueue_outbox, init_db, update_last_course_data
+from service.outbox import BATCH_SIZE, OUTBOX_WORKERS, RETRY_DELAY
+
+FIRST_ID = 9 * 10 ** 12
+
+
+async def create_subscribers(pool, count):
+    users = [(FIRST_ID + i, "bench", "bench", FIRST_ID + i, False) for i in range(count)]
+    async with pool.acquire() as connection:
+        await connection.executemany("""
+            INSERT INTO users (user_id, name, username, chat_id, is_bot, date_start, timezone)
+            VALUES ($1, $2, $3, $4, $5, now(), 'UTC') ON CONFLICT (user_id) DO NOTHING
+        """, users)
+        await connection.execute("""
+            INSERT INTO subscription (user_id, active)
+            SELECT user_id, TRUE FROM users WHERE user_id >= $1
+            ON CONFLICT (user_id) DO UPDATE SET active = TRUE
+        """, FIRST_ID)
+
+
+async def drop_subscribers(pool):
+    await pool.execute("DELETE FROM outbox WHERE user_id >= $1", FIRST_ID)
+    await pool.execute("DELETE FROM users WHERE user_id >= $1", FIRST_ID)
+
+
+async def per_row(pool, updates, concurrency):
+    """Прежний путь: каждый отправитель рассылки сохраняет свой текст отдельным запросом."""
+    pending = iter(updates)
+
+    async def worker():
+        for user_id, text in pending:
+            await update_last_course_data(pool, user_id, text)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def enqueue_sent(pool, run, updates):
+    """Ставит рассылку в outbox и возвращает id сообщений пачками, как их забирают обработчики."""
+    await enqueue_outbox(pool, "rates", [(f"bench:{run}:{user_id}", user_id, text) for user_id, text in updates])
+    ids = [row["id"] for row in await pool.fetch(
+        "SELECT id FROM outbox WHERE user_id >= $1 AND status = 'pending' ORDER BY id", FIRST_ID
+    )]
+    return [ids[i:i + BATCH_SIZE] for i in range(0, len(ids), BATCH_SIZE)]
+
+
+async def outbox_batches(pool, batches):
+    """Путь бота: OUTBOX_WORKERS обработчиков записывают итоги своих пачек."""
+    pending = iter(batches)
+
+    async def worker():
+        for batch in pending:
+            await complete_outbox(pool, batch, [], [], RETRY_DELAY)
+
+    await asyncio.gather(*(worker() for _ in range(OUTBOX_WORKERS)))
+
+
+async def main(args):
+    pool = await create_db_pool(max_size=max(args.concurrency, 2))
+    try:
+        await init_db(pool)
+        await create_subscribers(pool, args.users)
+        text = "18/10/2026\nДоллар США = 81.2345\nЕвро = 94.5678\n"
+
+        print(f"{args.users} subscribers, {args.concurrency} concurrent senders")
+        for run in range(2):
+            updates = [(FIRST_ID + i, f"{text}{run}") for i in range(args.users)]
+            started = time.perf_counter()
+            await per_row(pool, updates, args.concurrency)
+            row_time = time.perf_counter() - started
+
+            batches = await enqueue_sent(pool, run, [(user_id, f"{text}{run}b") for user_id, _ in updates])
+            started = time.perf_counter()
+            await outbox_batches(pool, batches)
+            batch_time = time.perf_counter() - started
+            print(f"run {run + 1}: per-row {row_time:.2f} s, outbox batches of {BATCH_SIZE} {batch_time:.3f} s "
+                  f"({row_time / batch_time:.0f}x)")
+    finally:
+        await drop_subscribers(pool)
+        await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
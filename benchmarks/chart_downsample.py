@@ -0,0 +1,69 @@
+"""
+Размер HTML и время отрисовки графика за длинный период с прореживанием и без.
+
+Запуск: python -m benchmarks.chart_downsample [--years 25] [--currencies 3] [--max-points 1000]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from service.downsample import downsample, points_per_trace
+from service.render import render_chart
+from service.series import RateSeries
+
+END_YEAR = 2025
+
+
+def make_series(years, seed):
+    """Случайное блуждание по рабочим дням за years лет."""
+    rng = np.random.default_rng(seed)
+    dates = np.arange(np.datetime64(f"{END_YEAR - years + 1}-01-01"), np.datetime64(f"{END_YEAR + 1}-01-01"))
+    dates = dates[np.is_busday(dates)]
+    values = 50 + np.cumsum(rng.normal(0, 0.3, len(dates)))
+    return RateSeries(dates, values)
+
+
+def build_entries(series_by_name, start_year, end_year, mode, max_points):
+    per_trace = points_per_trace(start_year, end_year, max_points)
+    entries = []
+    for name, series in series_by_name.items():
+        for year in range(start_year, end_year + 1):
+            year_data = downsample(series.years(year, year), per_trace, mode)
+            entries.append((name, year, year_data.dates, year_data.values))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=int, default=25)
+    parser.add_argument("--currencies", type=int, default=3)
+    parser.add_argument("--max-points", type=int, default=1000)
+    args = parser.parse_args()
+
+    start_year = END_YEAR - args.years + 1
+    series_by_name = {f"CUR{i}": make_series(args.years, i) for i in range(args.currencies)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Пустой график: размер встроенного plotly.js, чтобы показать объем самих данных
+        empty_path = os.path.join(tmp, "empty.html")
+        render_chart("", [], start_year, END_YEAR, empty_path)
+        bundle_size = os.path.getsize(empty_path)
+
+        print(f"{args.currencies} currencies x {args.years} years, max {args.max_points} points per currency")
+        print(f"{'mode':<8}{'points':>8}{'render, s':>11}{'html, KiB':>11}{'data, KiB':>11}")
+        for mode in ("off", "lttb", "minmax"):
+            entries = build_entries(series_by_name, start_year, END_YEAR, mode, args.max_points)
+            points = sum(len(dates) for _, _, dates, _ in entries)
+            path = os.path.join(tmp, f"{mode}.html")
+            started = time.perf_counter()
+            render_chart("bench", entries, start_year, END_YEAR, path)
+            elapsed = time.perf_counter() - started
+            size = os.path.getsize(path)
+            print(f"{mode:<8}{points:>8}{elapsed:>11.2f}{size / 1024:>11.0f}{(size - bundle_size) / 1024:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
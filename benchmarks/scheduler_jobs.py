@@ -0,0 +1,112 @@
+"""
+Пропускная способность задач планировщика и пиковая память: прежняя модель
+(ThreadPoolExecutor(20), в каждой задаче asyncio.run со своей HTTP-сессией)
+против корутин в основном цикле через BoundedAsyncIOExecutor с общей сессией.
+
+Задача имитирует отправку сообщения: открывает сессию (в старой модели) и
+ждет --io-ms миллисекунд ввода-вывода. Каждая модель запускается в отдельном
+процессе, чтобы пиковый RSS не смешивался.
+
+Запуск: python -m benchmarks.scheduler_jobs [--jobs 2000] [--io-ms 50] [--limit 100]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import aiohttp
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.date import DateTrigger
+
+from service.job_executor import BoundedAsyncIOExecutor
+
+
+async def send(session, io_seconds):
+    await asyncio.sleep(io_seconds)  # Запрос к Telegram/БД
+
+
+async def legacy_job(io_seconds):
+    async with aiohttp.ClientSession() as session:
+        await send(session, io_seconds)
+
+
+def threaded_job(io_seconds):
+    """Как прежний sync_send_greeting: новый цикл событий и новая сессия на каждый запуск."""
+    asyncio.run(legacy_job(io_seconds))
+
+
+async def run_model(model, jobs, io_seconds, limit):
+    if model == "threaded":
+        executor = ThreadPoolExecutor(20)
+        func, session = threaded_job, None
+        make_args = lambda: [io_seconds]
+    else:
+        executor = BoundedAsyncIOExecutor(limit)
+        session = aiohttp.ClientSession()
+        func = send
+        make_args = lambda: [session, io_seconds]
+
+    scheduler = AsyncIOScheduler(executors={"default": executor},
+                                 job_defaults={"misfire_grace_time": None})
+    loop = asyncio.get_running_loop()
+    done = asyncio.Event()
+    finished = 0
+
+    def count():
+        nonlocal finished
+        finished += 1
+        if finished == jobs:
+            done.set()
+
+    def on_finished(event):
+        # В потоковой модели события приходят из потоков пула
+        loop.call_soon_threadsafe(count)
+
+    scheduler.add_listener(on_finished, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+    run_date = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=1)
+    for i in range(jobs):
+        scheduler.add_job(func, DateTrigger(run_date=run_date), args=make_args(), id=f"job_{i}")
+
+    scheduler.start()
+    await asyncio.sleep((run_date - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+    started = time.perf_counter()
+    await done.wait()
+    elapsed = time.perf_counter() - started
+    scheduler.shutdown(wait=False)
+    if session is not None:
+        await session.close()
+    return {"jobs_per_sec": jobs / elapsed, "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--io-ms", type=float, default=50)
+    parser.add_argument("--limit", type=int, default=100, help="Лимит одновременных задач в async-модели")
+    parser.add_argument("--model", choices=["threaded", "async"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.model:
+        result = asyncio.run(run_model(args.model, args.jobs, args.io_ms / 1000, args.limit))
+        print(json.dumps(result))
+        return
+
+    print(f"{args.jobs} jobs, {args.io_ms:.0f} ms I/O each")
+    for model in ("threaded", "async"):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.scheduler_jobs", "--model", model, "--jobs", str(args.jobs),
+             "--io-ms", str(args.io_ms), "--limit", str(args.limit)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{model:>8}: {result['jobs_per_sec']:8.0f} jobs/s, peak RSS {result['max_rss_mb']:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
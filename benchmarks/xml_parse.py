@@ -0,0 +1,106 @@
+"""
+Сравнение разбора XML_dynamic: прежний путь (ET.fromstring + findall/find)
+против потокового DynamicStream на бэкендах xml.etree и lxml.
+
+"ElementTree dict" — старый parse_xml_data ({год: {строка даты: курс}}),
+"ElementTree records" — тот же разбор с типизированным результатом, как у потока.
+
+Запуск: python -m benchmarks.xml_parse [--years 25] [--repeat 5]
+"""
+import argparse
+import datetime
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from service.xml_stream import DynamicStream, lxml_etree
+
+CHUNK_SIZE = 64 * 1024
+
+
+def make_dynamic_xml(years):
+    """Синтетический ответ XML_dynamic: одна запись на каждый рабочий день."""
+    end = datetime.date.today()
+    day = end - datetime.timedelta(days=365 * years)
+    parts = ['<?xml version="1.0" encoding="windows-1251"?>'
+             '<ValCurs ID="R01235" DateRange1="x" DateRange2="y" name="Foreign Currency Market Dynamic">']
+    while day <= end:
+        if day.weekday() < 5:
+            value = f"{30 + (day.toordinal() % 7000) / 100:.4f}".replace(".", ",")
+            parts.append(f'<Record Date="{day:%d.%m.%Y}" Id="R01235">'
+                         f'<Nominal>1</Nominal><Value>{value}</Value><VunitRate>{value}</VunitRate></Record>')
+        day += datetime.timedelta(days=1)
+    parts.append('</ValCurs>')
+    return ''.join(parts).encode('cp1251')
+
+
+def parse_elementtree(xml_data):
+    """Прежняя реализация parse_xml_data."""
+    root = ET.fromstring(xml_data)
+    data = {}
+    for record in root.findall('Record'):
+        date_str = record.get('Date')
+        year = int(date_str.split('.')[2])
+        value = float(record.find('Value').text.replace(',', '.')) / float(record.find('Nominal').text)
+        data.setdefault(year, {})[date_str] = value
+    return data
+
+
+def parse_elementtree_records(xml_data):
+    """ElementTree с тем же результатом, что и у потокового разбора: (дата, курс)."""
+    root = ET.fromstring(xml_data)
+    records = []
+    for record in root.findall('Record'):
+        date = datetime.datetime.strptime(record.get('Date'), "%d.%m.%Y").date()
+        value = float(record.find('Value').text.replace(',', '.')) / float(record.find('Nominal').text)
+        records.append((date, value))
+    return records
+
+
+def parse_stream(xml_data, backend):
+    """Потоковый разбор порциями, как при чтении ответа aiohttp."""
+    stream = DynamicStream(backend)
+    records = []
+    for offset in range(0, len(xml_data), CHUNK_SIZE):
+        records += stream.feed(xml_data[offset:offset + CHUNK_SIZE])
+    return records + stream.close()
+
+
+def measure(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=int, default=25)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    xml_data = make_dynamic_xml(args.years)
+    print(f"XML_dynamic: {len(xml_data) / 1024:.0f} KiB, {args.years} years")
+
+    cases = [
+        ("ElementTree dict", lambda: parse_elementtree(xml_data)),
+        ("ElementTree records", lambda: parse_elementtree_records(xml_data)),
+        ("stream etree", lambda: parse_stream(xml_data, "etree")),
+    ]
+    if lxml_etree is not None:
+        cases.append(("stream lxml", lambda: parse_stream(xml_data, "lxml")))
+
+    print(f"{'parser':<24}{'time, ms':>10}{'peak, KiB':>12}")
+    for name, func in cases:
+        elapsed, peak = measure(func, args.repeat)
+        print(f"{name:<24}{elapsed * 1000:>10.1f}{peak / 1024:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
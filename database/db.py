@@ -1,20 +1,72 @@
 #db.py
+import asyncio
 import json
 import os
+import uuid
 from datetime import datetime
 
 import asyncpg
+import numpy as np
 from dotenv import load_dotenv
 
+from database.user_cache import user_cache
 from logger.logging_settings import logger
+from service.metrics import Histogram
+from service.series import RateSeries
 
 # Загружаем переменные из .env
 load_dotenv()
 
+# Размер общего пула приложения: min_size соединений держатся открытыми всегда
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN", 2))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX", 10))
+# Простаивающее соединение закрывается не раньше чем через час: вместе с ним
+# теряется кэш подготовленных запросов
+POOL_IDLE_LIFETIME = float(os.getenv("DB_POOL_IDLE_LIFETIME", 3600))
+COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", 30))
+# Запросы дольше этого пишутся в лог
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", 200))
+# Канал уведомлений об изменении профилей и проверка соединения, которое их слушает
+PROFILE_CHANNEL = "user_profile"
+# Метка процесса в соединениях общего пула: свои уведомления процесс пропускает,
+# кэш после своих записей он обновляет сам
+INSTANCE_ID = uuid.uuid4().hex
+INSTANCE_SETTING = "currency_bot.instance"
+LISTEN_CHECK_INTERVAL = float(os.getenv("DB_LISTEN_CHECK_INTERVAL", 30))
+LISTEN_RETRY_MAX = 60
 
-async def create_db_pool():
-    """Создает пул подключений к базе данных."""
-    return await asyncpg.create_pool(
+query_seconds = Histogram(
+    "db_query_seconds",
+    "Время выполнения запросов к базе данных",
+    buckets=[0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5],
+)
+
+
+def query_name(query):
+    """Короткое имя запроса для метрик: начало текста в одну строку."""
+    return " ".join(query.split())[:60]
+
+
+def _observe_query(record):
+    query_seconds.observe(record.elapsed, query=query_name(record.query))
+    if record.elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning(f"Медленный запрос ({record.elapsed * 1000:.0f} мс): {query_name(record.query)}")
+
+
+def _json_dumps(value):
+    return json.dumps(value, ensure_ascii=False)
+
+
+async def _init_connection(connection):
+    # JSON/JSONB читаются и пишутся объектами Python, без json.loads/dumps в каждом запросе
+    for type_name in ("json", "jsonb"):
+        await connection.set_type_codec(type_name, encoder=_json_dumps, decoder=json.loads, schema="pg_catalog")
+    # Время каждого запроса этого соединения попадает в db_query_seconds
+    connection.add_query_logger(_observe_query)
+
+
+def _connect_params():
+    return dict(
         user=os.getenv("DB_USER"),
         password=os.getenv("DB_PASSWORD"),
         database=os.getenv("DB_NAME"),
@@ -23,6 +75,38 @@ async def create_db_pool():
     )
 
 
+async def create_db_pool(min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE):
+    """
+    Создает пул подключений к базе данных.
+
+    Общий пул приложения один: его создает main.py и передает обработчикам (через
+    диспетчер aiogram), задачам планировщика и рассылке. asyncpg подготавливает
+    каждый запрос один раз на соединение и дальше берет его из кэша, поэтому
+    тексты запросов в этом модуле постоянные, а параметры передаются отдельно.
+    """
+    return await asyncpg.create_pool(
+        **_connect_params(),
+        min_size=min_size,
+        max_size=max_size,
+        max_inactive_connection_lifetime=POOL_IDLE_LIFETIME,
+        command_timeout=COMMAND_TIMEOUT,
+        init=_init_connection,
+        server_settings={INSTANCE_SETTING: INSTANCE_ID},
+    )
+
+
+async def init_db(pool):
+    """Создает таблицы приложения, если их еще нет."""
+    await create_table(pool)
+    await create_user_tables(pool)
+    await migrate_user_data(pool)
+    await create_profile_triggers(pool)
+    await create_history_table(pool)
+    await create_chart_requests_table(pool)
+    await create_outbox_table(pool)
+    await create_fsm_state_table(pool)
+
+
 async def create_table(pool):
     """Создает таблицу 'users', если она не существует."""
     try:
@@ -37,11 +121,11 @@ async def create_table(pool):
                     is_premium BOOLEAN DEFAULT FALSE,
                     date_start TIMESTAMP NOT NULL,
                     timezone TEXT NOT NULL,
-                    currency_data JSONB DEFAULT '[]',                   
-                    everyday BOOLEAN DEFAULT FALSE,
+                    currency_data JSONB DEFAULT '[]',  -- устарело: user_currency
+                    everyday BOOLEAN DEFAULT FALSE,  -- устарело: subscription.active
                     location JSONB DEFAULT '[]',
                     jobs JSONB DEFAULT '[]',
-                    last_course_data TEXT DEFAULT ''
+                    last_course_data TEXT DEFAULT ''  -- устарело: subscription.last_course_data
                 );
             """)
             logger.info("Table 'users' has been created or already exists.")
@@ -51,6 +135,153 @@ async def create_table(pool):
         raise  # Повторно выбрасываем исключение для обработки на более высоком уровне
 
 
+async def create_user_tables(pool):
+    """
+    Создает нормализованные таблицы настроек пользователей:
+    user_currency — выбранные валюты, subscription — ежедневная рассылка.
+    """
+    try:
+        async with pool.acquire() as connection:
+            await connection.execute("""
+                CREATE TABLE IF NOT EXISTS user_currency (
+                    user_id BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+                    currency_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    char_code TEXT NOT NULL,
+                    position INT NOT NULL,
+                    PRIMARY KEY (user_id, currency_id)
+                );
+                CREATE INDEX IF NOT EXISTS user_currency_currency_idx ON user_currency (currency_id);
+
+                CREATE TABLE IF NOT EXISTS subscription (
+                    user_id BIGINT PRIMARY KEY REFERENCES users (user_id) ON DELETE CASCADE,
+                    active BOOLEAN NOT NULL DEFAULT FALSE,
+                    last_course_data TEXT NOT NULL DEFAULT '',
+                    updated_at TIMESTAMP NOT NULL DEFAULT now()
+                );
+                CREATE INDEX IF NOT EXISTS subscription_active_idx ON subscription (user_id) WHERE active;
+
+                CREATE INDEX IF NOT EXISTS users_jobs_idx ON users (user_id) WHERE jobs <> '[]'::jsonb;
+
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    name TEXT PRIMARY KEY,
+                    applied_at TIMESTAMP NOT NULL DEFAULT now()
+                );
+            """)
+            logger.info("Tables 'user_currency', 'subscription' have been created or already exist.")
+    except Exception as e:
+        logger.error(f"Error creating user tables: {e}")
+        raise
+
+
+async def migrate_user_data(pool):
+    """
+    Один раз переносит currency_data, everyday и last_course_data из 'users'
+    в user_currency и subscription. Старые столбцы остаются, но больше не используются.
+    Валюты, сохраненные только названием (без id), не переносятся — их нужно выбрать заново.
+    """
+    name = "normalize_user_currency_subscription"
+    try:
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                # Блокировка на случай одновременного запуска нескольких процессов бота
+                await connection.execute("LOCK TABLE schema_migrations IN EXCLUSIVE MODE")
+                if await connection.fetchval("SELECT 1 FROM schema_migrations WHERE name = $1", name):
+                    return
+                await connection.execute("""
+                    INSERT INTO user_currency (user_id, currency_id, name, char_code, position)
+                    SELECT u.user_id, item.value->>'id', item.value->>'name', item.value->>'charCode', item.position
+                    FROM users u,
+                         jsonb_array_elements(u.currency_data) WITH ORDINALITY AS item(value, position)
+                    WHERE jsonb_typeof(u.currency_data) = 'array'
+                      AND jsonb_typeof(item.value) = 'object' AND item.value ? 'id'
+                    ON CONFLICT (user_id, currency_id) DO NOTHING
+                """)
+                await connection.execute("""
+                    INSERT INTO subscription (user_id, active, last_course_data)
+                    SELECT user_id, coalesce(everyday, FALSE), coalesce(last_course_data, '') FROM users
+                    ON CONFLICT (user_id) DO NOTHING
+                """)
+                await connection.execute("INSERT INTO schema_migrations (name) VALUES ($1)", name)
+                logger.info(f"Migration '{name}' has been applied.")
+    except Exception as e:
+        logger.error(f"Error applying migration '{name}': {e}")
+        raise
+
+
+async def create_profile_triggers(pool):
+    """
+    Создает триггеры, которые при любом изменении users, subscription и user_currency
+    отправляют в канал PROFILE_CHANNEL "метка процесса:user_id" (см. listen_profile_changes).
+    Метка берется из настройки INSTANCE_SETTING соединения, у сторонних клиентов она пустая.
+    """
+    try:
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                # Блокировка на случай одновременного запуска нескольких процессов бота
+                await connection.execute("LOCK TABLE schema_migrations IN EXCLUSIVE MODE")
+                await connection.execute(f"""
+                    CREATE OR REPLACE FUNCTION notify_user_profile() RETURNS trigger AS $$
+                    BEGIN
+                        PERFORM pg_notify('{PROFILE_CHANNEL}',
+                            coalesce(current_setting('{INSTANCE_SETTING}', TRUE), '') || ':' ||
+                            (CASE WHEN TG_OP = 'DELETE' THEN OLD.user_id ELSE NEW.user_id END)::text);
+                        RETURN NULL;
+                    END
+                    $$ LANGUAGE plpgsql;
+                """)
+                for table in ("users", "subscription", "user_currency"):
+                    await connection.execute(f"""
+                        DROP TRIGGER IF EXISTS {table}_notify_profile ON {table};
+                        CREATE TRIGGER {table}_notify_profile AFTER INSERT OR UPDATE OR DELETE ON {table}
+                            FOR EACH ROW EXECUTE FUNCTION notify_user_profile();
+                    """)
+            logger.info("Profile change triggers have been created.")
+    except Exception as e:
+        logger.error(f"Error creating profile change triggers: {e}")
+        raise
+
+
+async def listen_profile_changes():
+    """
+    Слушает PROFILE_CHANNEL и сбрасывает в кэше профилей (database/user_cache.py)
+    профили, измененные другими процессами бота. Работает до отмены задачи.
+
+    Пока соединение не установлено или потеряно, уведомления могут теряться,
+    поэтому кэш отключен и все чтения идут в БД; после подключения он начинается с нуля.
+    """
+    def on_notify(connection, pid, channel, payload):
+        instance, _, user_id = payload.rpartition(":")
+        if instance != INSTANCE_ID:
+            user_cache.invalidate(int(user_id))
+
+    def on_lost(connection):
+        user_cache.suspend()
+
+    delay = 1
+    while True:
+        user_cache.suspend()
+        connection = None
+        try:
+            connection = await asyncpg.connect(**_connect_params())
+            connection.add_termination_listener(on_lost)
+            await connection.add_listener(PROFILE_CHANNEL, on_notify)
+            user_cache.resume()
+            delay = 1
+            while not connection.is_closed():
+                await asyncio.sleep(LISTEN_CHECK_INTERVAL)
+                # Обрыв без закрытия сокета замечается только по запросу
+                await connection.fetchval("SELECT 1", timeout=LISTEN_CHECK_INTERVAL)
+        except Exception as e:
+            logger.error(f"Profile change listener lost the database connection: {e}")
+        finally:
+            user_cache.suspend()
+            if connection is not None:
+                connection.terminate()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, LISTEN_RETRY_MAX)
+
+
 async def add_user_to_db(pool, user_data):
     """Добавляет пользователя в базу данных."""
     try:
@@ -72,6 +303,7 @@ async def add_user_to_db(pool, user_data):
                 VALUES ($1, $2, $3, $4, $5, $6, $7)
                 ON CONFLICT (user_id) DO NOTHING
             """, *formatted_data.values())
+            user_cache.invalidate(formatted_data['user_id'])
             logger.info(f"User {formatted_data['user_id']} added to the database.")
     except Exception as e:
         logger.error(f"Error adding user to the database: {e}")
@@ -80,123 +312,218 @@ async def add_user_to_db(pool, user_data):
 
 async def update_user_everyday(pool, user_id, everyday):
     """Обновляет статус ежедневной рассылки пользователя в БД."""
-    try:
-        async with pool.acquire() as connection:
-            # Преобразуем значение everyday в булевое значение, если оно не является таковым
-            if isinstance(everyday, bool):
-                everyday_value = everyday
-            elif isinstance(everyday, int):
-                # Преобразуем числа 0/1 в False/True
-                everyday_value = bool(everyday)
-            else:
-                logger.error(f"Invalid value for 'everyday': {everyday}. Expected a boolean or integer.")
-                return
-
-            query = "UPDATE users SET everyday = $1 WHERE user_id = $2"
-            await connection.execute(query, everyday_value, user_id)
-            # logger.info(f"Status of daily subscription was updated by user {user_id} to {everyday_value}")
-    except Exception as e:
-        logger.error(f"Error updating user {user_id} everyday status: {e}")
-        raise
+    # Преобразуем значение everyday в булевое значение, если оно не является таковым
+    if isinstance(everyday, bool):
+        everyday_value = everyday
+    elif isinstance(everyday, int):
+        # Преобразуем числа 0/1 в False/True
+        everyday_value = bool(everyday)
+    else:
+        logger.error(f"Invalid value for 'everyday': {everyday}. Expected a boolean or integer.")
+        return
+    await update_user_profile(pool, user_id, everyday=everyday_value)
 
 
 async def update_user_currency(pool: asyncpg.Pool, user_id: int, selected_currency):
-    """Обновляет данные о валюте пользователя в БД."""
-    try:
-        async with pool.acquire() as connection:
-            # Определяем корректный формат для хранения в jsonb
-            if isinstance(selected_currency, list) and all(isinstance(item, dict) for item in selected_currency):
-                currency_data = json.dumps(selected_currency, ensure_ascii=False)  # Конвертируем в JSON-строку
-            elif isinstance(selected_currency, set) and all(isinstance(item, str) for item in selected_currency):
-                currency_data = json.dumps(list(selected_currency),
-                                           ensure_ascii=False)  # Преобразуем множество в список и затем в JSON
-            else:
-                raise ValueError("Неподдерживаемый формат selected_currency")
+    """Обновляет выбранные валюты пользователя: список [{"id", "name", "charCode"}]."""
+    if not (isinstance(selected_currency, list) and all(isinstance(item, dict) for item in selected_currency)):
+        raise ValueError("Неподдерживаемый формат selected_currency")
+    await update_user_profile(pool, user_id, currency_data=selected_currency)
+    logger.info(f"User {user_id} currency updated successfully.")
 
-            # SQL-запрос для обновления jsonb-поля
-            query = "UPDATE users SET currency_data = $1 WHERE user_id = $2"
-            await connection.execute(query, currency_data, user_id)
-
-            logger.info(f"User {user_id} currency updated successfully.")
-    except Exception as e:
-        logger.error(f"Error updating user {user_id} currency: {e}")
-        raise
 
 async def update_user_jobs(pool: asyncpg.Pool, user_id: int, job_id: str) -> None:
-    """Добавляет job_id в массив jobs для указанного user_id."""
+    """Добавляет job_id в массив jobs для указанного user_id (None — очищает список)."""
     try:
         async with pool.acquire() as connection:
-            # Получаем текущий массив jobs
-            current_jobs = await connection.fetchval(
-                "SELECT jobs FROM users WHERE user_id = $1", user_id
-            )
-
-            # Если jobs отсутствует или это строка, создаем новый массив
-            if current_jobs is None or isinstance(current_jobs, str):
-                current_jobs = []
-
-            # Если current_jobs — это строка, преобразуем её в список
-            if isinstance(current_jobs, str):
-                try:
-                    current_jobs = json.loads(current_jobs)
-                except json.JSONDecodeError:
-                    current_jobs = []
-
-            # Добавляем новый job_id в массив, если его там нет
-            if job_id not in current_jobs:
-                current_jobs.append(job_id)
-
-            # Обновляем столбец jobs
-            await connection.execute(
-                "UPDATE users SET jobs = $1::jsonb WHERE user_id = $2",
-                json.dumps(current_jobs, ensure_ascii=False),  # Преобразуем список в JSON-строку
-                user_id
-            )
+            if job_id is None:
+                await connection.execute("UPDATE users SET jobs = '[]' WHERE user_id = $1", user_id)
+            else:
+                # Добавляем новый job_id в массив, если его там нет
+                await connection.execute("""
+                    UPDATE users SET jobs = jobs || to_jsonb($2::text)
+                    WHERE user_id = $1 AND NOT jobs ? $2
+                """, user_id, job_id)
+            user_cache.invalidate(user_id)
     except Exception as e:
         logger.error(f"Error updating jobs for user {user_id}: {e}")
         raise
 
+
 async def get_user_jobs(pool: asyncpg.Pool, user_id: int):
-    """Возвращает задачи из планировщика пользователя."""
-    try:
-        async with pool.acquire() as connection:
-            result = await connection.fetchval(
-                "SELECT jobs FROM users WHERE user_id = $1", user_id
-            )
+    """Возвращает задачи из планировщика пользователя (через кэш профилей)."""
+    profile = await get_user_profile(pool, user_id)
+    return list(profile.jobs) if profile else []
 
-            if result:
-                return json.loads(result)  # Декодируем JSON-строку обратно в Python-объект
-            return []  # Если данных нет, возвращаем пустой список
-
-    except Exception as e:
-        logger.error(f"Error fetching selected_currency for {user_id} from the database: {e}")
-        return []
 
 async def update_last_course_data(pool: asyncpg.Pool, user_id: int, course_data: str) -> None:
     """Обновляет последнее отправленное значение курса валют для указанного user_id."""
     try:
-        async with pool.acquire() as connection:
-            await connection.execute(
-                "UPDATE users SET last_course_data = $1 WHERE user_id = $2",
-                course_data,
-                user_id
-            )
-            logger.info(f"Last course data updated for user {user_id}.")
+        await update_user_profile(pool, user_id, last_course_data=course_data)
+        logger.info(f"Last course data updated for user {user_id}.")
     except Exception as e:
         logger.error(f"Error updating last_course_data for user {user_id}: {e}")
         raise
 
+
 async def get_last_course_data(pool: asyncpg.Pool, user_id: int) -> str:
     """Возвращает последнее отправленное значение курса валют для указанного user_id."""
+    profile = await get_user_profile(pool, user_id)
+    return profile.last_course_data if profile else ""
+
+
+class UserProfile:
+    """Настройки пользователя, которые нужны обработчикам, одной строкой запроса."""
+    __slots__ = ("user_id", "currency_data", "everyday", "jobs", "last_course_data", "location")
+
+    def __init__(self, user_id, currency_data, everyday, jobs, last_course_data, location):
+        self.user_id = user_id
+        self.currency_data = currency_data  # Список выбранных валют [{"id", "name", "charCode"}]
+        self.everyday = everyday
+        self.jobs = jobs
+        self.last_course_data = last_course_data
+        self.location = location
+
+    @classmethod
+    def from_row(cls, row):
+        # JSONB приходит уже разобранным (кодек в _init_connection)
+        return cls(
+            user_id=row['user_id'],
+            currency_data=row['currency_data'] or [],
+            everyday=bool(row['everyday']),
+            jobs=row['jobs'] or [],
+            last_course_data=row['last_course_data'] or "",
+            location=row['location'] or [],
+        )
+
+
+# Выражения полей профиля: users u, subscription s, валюты — из user_currency по порядку выбора
+PROFILE_FIELDS = {
+    "currency_data": """coalesce((
+        SELECT jsonb_agg(jsonb_build_object('id', c.currency_id, 'name', c.name, 'charCode', c.char_code)
+                         ORDER BY c.position)
+        FROM user_currency c WHERE c.user_id = u.user_id), '[]'::jsonb)""",
+    "everyday": "coalesce(s.active, FALSE)",
+    "jobs": "u.jobs",
+    "last_course_data": "coalesce(s.last_course_data, '')",
+    "location": "u.location",
+}
+PROFILE_FROM = "FROM users u LEFT JOIN subscription s ON s.user_id = u.user_id WHERE u.user_id = $1"
+PROFILE_QUERY = (f"SELECT u.user_id, {', '.join(f'{expr} AS {name}' for name, expr in PROFILE_FIELDS.items())} "
+                 f"{PROFILE_FROM}")
+
+
+def _profile_update_query(changes):
+    """
+    Один запрос на любой набор изменений профиля: записи в users, subscription
+    и user_currency идут в CTE, а итоговый SELECT возвращает новый профиль
+    (измененные поля берутся из параметров — CTE видят снимок до записи).
+
+    Returns:
+        (str, list): Текст запроса и параметры начиная с $2.
+    """
+    params = []
+    fields = dict(PROFILE_FIELDS)
+    ctes = []
+
+    def param(value, cast=""):
+        params.append(value)
+        return f"${len(params) + 1}{cast}"
+
+    user_exists = "EXISTS (SELECT 1 FROM users WHERE user_id = $1)"
+
+    users_set = []
+    for column in ("jobs", "location"):
+        if column in changes:
+            placeholder = param(changes[column], "::jsonb")
+            users_set.append(f"{column} = {placeholder}")
+            fields[column] = placeholder
+    if users_set:
+        ctes.append(f"users_update AS (UPDATE users SET {', '.join(users_set)} WHERE user_id = $1)")
+
+    subscription_columns = {"everyday": "active", "last_course_data": "last_course_data"}
+    changed = [field for field in subscription_columns if field in changes]
+    if changed:
+        columns = [subscription_columns[field] for field in changed]
+        placeholders = [param(changes[field], "::boolean" if field == "everyday" else "::text")
+                        for field in changed]
+        fields.update(zip(changed, placeholders))
+        updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns)
+        ctes.append(f"""subscription_upsert AS (
+            INSERT INTO subscription (user_id, {', '.join(columns)})
+            SELECT $1, {', '.join(placeholders)} WHERE {user_exists}
+            ON CONFLICT (user_id) DO UPDATE SET {updates}, updated_at = now())""")
+
+    if "currency_data" in changes:
+        currencies = param(changes["currency_data"], "::jsonb")
+        fields["currency_data"] = currencies
+        # Удаляем снятые валюты и добавляем/переупорядочиваем выбранные — строки не пересекаются
+        ctes.append(f"""currency_delete AS (
+            DELETE FROM user_currency WHERE user_id = $1
+              AND currency_id <> ALL (ARRAY(SELECT item->>'id' FROM jsonb_array_elements({currencies}) item)))""")
+        ctes.append(f"""currency_upsert AS (
+            INSERT INTO user_currency (user_id, currency_id, name, char_code, position)
+            SELECT $1, item.value->>'id', item.value->>'name', item.value->>'charCode', item.position
+            FROM jsonb_array_elements({currencies}) WITH ORDINALITY AS item(value, position)
+            WHERE {user_exists}
+            ON CONFLICT (user_id, currency_id)
+            DO UPDATE SET name = EXCLUDED.name, char_code = EXCLUDED.char_code, position = EXCLUDED.position)""")
+
+    select = f"SELECT u.user_id, {', '.join(f'{expr} AS {name}' for name, expr in fields.items())} {PROFILE_FROM}"
+    return f"WITH {', '.join(ctes)} {select}", params
+
+
+async def get_user_profile(pool: asyncpg.Pool, user_id: int):
+    """
+    Возвращает UserProfile пользователя или None, если его нет.
+    Сначала смотрит в кэш профилей (database/user_cache.py), иначе — один запрос в БД.
+    """
+    profile = user_cache.get(user_id)
+    if profile is not None:
+        return profile
+
+    generation = user_cache.generation()
     try:
         async with pool.acquire() as connection:
-            result = await connection.fetchval(
-                "SELECT last_course_data FROM users WHERE user_id = $1", user_id
-            )
-            return result if result else ""
+            row = await connection.fetchrow(PROFILE_QUERY, user_id)
+            if row is None:
+                return None
+            profile = UserProfile.from_row(row)
+            user_cache.put(user_id, profile, generation)
+            return profile
     except Exception as e:
-        logger.error(f"Error fetching last_course_data for user {user_id}: {e}")
-        return ""
+        logger.error(f"Error fetching profile for {user_id} from the database: {e}")
+        return None
+
+
+async def update_user_profile(pool: asyncpg.Pool, user_id: int, **changes):
+    """
+    Применяет изменения профиля одним запросом и возвращает обновленный UserProfile.
+
+    Пример: await update_user_profile(pool, user_id, everyday=True, last_course_data=text)
+    """
+    unknown = set(changes) - set(PROFILE_FIELDS)
+    if unknown:
+        raise ValueError(f"Неизвестные поля профиля: {', '.join(sorted(unknown))}")
+    if not changes:
+        return await get_user_profile(pool, user_id)
+
+    # Поля в постоянном порядке: один и тот же набор изменений — один подготовленный запрос
+    query, params = _profile_update_query({field: changes[field] for field in PROFILE_FIELDS if field in changes})
+    try:
+        async with pool.acquire() as connection:
+            row = await connection.fetchrow(query, user_id, *params)
+            user_cache.invalidate(user_id)
+            if row is None:
+                return None
+            profile = UserProfile.from_row(row)
+            user_cache.put(user_id, profile)
+            return profile
+    except Exception as e:
+        user_cache.invalidate(user_id)
+        logger.error(f"Error updating profile for {user_id}: {e}")
+        raise
+
 
 async def get_user_by_id(pool, user_id):
     """Возвращает данные пользователя по его ID."""
@@ -210,33 +537,15 @@ async def get_user_by_id(pool, user_id):
 
 
 async def get_selected_currency(pool: asyncpg.Pool, user_id: int):
-    """Возвращает выбранные валюты пользователя."""
-    try:
-        async with pool.acquire() as connection:
-            result = await connection.fetchval(
-                "SELECT currency_data FROM users WHERE user_id = $1", user_id
-            )
-
-            if result:
-                return json.loads(result)  # Декодируем JSON-строку обратно в Python-объект
-            return []  # Если данных нет, возвращаем пустой список
-
-    except Exception as e:
-        logger.error(f"Error fetching selected_currency for {user_id} from the database: {e}")
-        return []
+    """Возвращает выбранные валюты пользователя (через кэш профилей)."""
+    profile = await get_user_profile(pool, user_id)
+    return list(profile.currency_data) if profile else []
 
 
 async def get_everyday(pool, user_id):
-    """Возвращает настройку 'everyday' пользователя."""
-    try:
-        async with pool.acquire() as connection:
-            result = await connection.fetchval(
-                "SELECT everyday FROM users WHERE user_id = $1", user_id
-            )
-            return result
-    except Exception as e:
-        logger.error(f"Error fetching everyday for {user_id} from the database: {e}")
-        return None
+    """Возвращает настройку 'everyday' пользователя (через кэш профилей)."""
+    profile = await get_user_profile(pool, user_id)
+    return profile.everyday if profile else None
 
 
 async def format_currency_from_db(db_result):
@@ -275,18 +584,407 @@ async def format_currency_from_db(db_result):
 
 
 async def get_all_jobs(pool: asyncpg.Pool):
-    """Возвращает задачи для всех пользователей."""
+    """Возвращает задачи всех пользователей: [{"user_id", "job_id"}]."""
     try:
         async with pool.acquire() as connection:
-            result = await connection.fetch("SELECT user_id, jobs FROM users")
-            jobs = []
-            for row in result:
-                if row['jobs']:
-                    user_jobs = json.loads(row['jobs'])
-                    for job in user_jobs:
-                        job['user_id'] = row['user_id']  # Добавляем user_id в каждую задачу
-                    jobs.extend(user_jobs)
-            return jobs
+            # Массивы разворачиваются в базе, пустые отсекаются частичным индексом
+            result = await connection.fetch("""
+                SELECT user_id, jsonb_array_elements_text(jobs) AS job_id
+                FROM users WHERE jobs <> '[]'::jsonb
+            """)
+            return [{"user_id": row['user_id'], "job_id": row['job_id']} for row in result]
     except Exception as e:
         logger.error(f"Error fetching jobs from the database: {e}")
-        return []
\ No newline at end of file
+        return []
+
+
+async def get_subscribers(pool: asyncpg.Pool):
+    """Возвращает всех подписчиков рассылки с выбранными валютами и последним отправленным курсом."""
+    try:
+        async with pool.acquire() as connection:
+            # Активные подписки — по частичному индексу, валюты — по первичному ключу user_currency
+            result = await connection.fetch("""
+                SELECT s.user_id, s.last_course_data,
+                       coalesce(jsonb_agg(jsonb_build_object('id', c.currency_id, 'name', c.name,
+                                                             'charCode', c.char_code)
+                                          ORDER BY c.position) FILTER (WHERE c.currency_id IS NOT NULL),
+                                '[]'::jsonb) AS currency_data
+                FROM subscription s
+                LEFT JOIN user_currency c ON c.user_id = s.user_id
+                WHERE s.active
+                GROUP BY s.user_id, s.last_course_data
+            """)
+            return [{
+                "user_id": row['user_id'],
+                "currency_data": row['currency_data'],
+                "last_course_data": row['last_course_data'] or "",
+            } for row in result]
+    except Exception as e:
+        logger.error(f"Error fetching subscribers from the database: {e}")
+        return []
+
+
+async def get_currency_subscribers(pool: asyncpg.Pool, currency_id: str):
+    """Возвращает user_id активных подписчиков, выбравших валюту (по индексу user_currency_currency_idx)."""
+    try:
+        async with pool.acquire() as connection:
+            result = await connection.fetch("""
+                SELECT c.user_id FROM user_currency c
+                JOIN subscription s ON s.user_id = c.user_id AND s.active
+                WHERE c.currency_id = $1
+            """, currency_id)
+            return [row['user_id'] for row in result]
+    except Exception as e:
+        logger.error(f"Error fetching subscribers of {currency_id}: {e}")
+        return []
+
+
+async def create_history_table(pool):
+    """Создает таблицу 'rate_history' с историей курсов ЦБ, если она не существует."""
+    try:
+        async with pool.acquire() as connection:
+            await connection.execute("""
+                CREATE TABLE IF NOT EXISTS rate_history (
+                    currency_id TEXT NOT NULL,
+                    date DATE NOT NULL,
+                    value DOUBLE PRECISION NOT NULL,
+                    PRIMARY KEY (currency_id, date)
+                );
+            """)
+            logger.info("Table 'rate_history' has been created or already exists.")
+    except Exception as e:
+        logger.error(f"Error creating table 'rate_history': {e}")
+        raise
+
+
+async def get_last_history_date(pool: asyncpg.Pool, currency_id: str):
+    """Возвращает последнюю сохраненную дату истории валюты или None."""
+    try:
+        async with pool.acquire() as connection:
+            return await connection.fetchval(
+                "SELECT max(date) FROM rate_history WHERE currency_id = $1", currency_id
+            )
+    except Exception as e:
+        logger.error(f"Error fetching last history date for {currency_id}: {e}")
+        return None
+
+
+async def save_history(pool: asyncpg.Pool, currency_id: str, records) -> None:
+    """Сохраняет записи (дата, курс) истории валюты, перезаписывая совпадающие даты."""
+    try:
+        async with pool.acquire() as connection:
+            await connection.executemany("""
+                INSERT INTO rate_history (currency_id, date, value)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (currency_id, date) DO UPDATE SET value = EXCLUDED.value
+            """, [(currency_id, date, value) for date, value in records])
+    except Exception as e:
+        logger.error(f"Error saving history for {currency_id}: {e}")
+        raise
+
+
+async def save_history_bulk(pool: asyncpg.Pool, rows) -> int:
+    """
+    Массово сохраняет записи (currency_id, дата, курс) через COPY во временную таблицу.
+
+    Returns:
+        int: Количество переданных записей.
+    """
+    try:
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute("""
+                    CREATE TEMP TABLE rate_history_load (LIKE rate_history) ON COMMIT DROP
+                """)
+                await connection.copy_records_to_table(
+                    "rate_history_load", records=rows, columns=["currency_id", "date", "value"]
+                )
+                await connection.execute("""
+                    INSERT INTO rate_history (currency_id, date, value)
+                    SELECT DISTINCT ON (currency_id, date) currency_id, date, value FROM rate_history_load
+                    ON CONFLICT (currency_id, date) DO UPDATE SET value = EXCLUDED.value
+                """)
+            return len(rows)
+    except Exception as e:
+        logger.error(f"Error bulk saving history: {e}")
+        raise
+
+
+async def get_history(pool: asyncpg.Pool, currency_id: str, start_year: int, end_year: int) -> RateSeries:
+    """Возвращает историю валюты за годы start_year..end_year в виде RateSeries."""
+    try:
+        async with pool.acquire() as connection:
+            # Два массива одной строкой вместо записи на каждый день: даты как число дней от 1970-01-01
+            row = await connection.fetchrow("""
+                SELECT array_agg(date - DATE '1970-01-01' ORDER BY date) AS days,
+                       array_agg(value ORDER BY date) AS values
+                FROM rate_history
+                WHERE currency_id = $1 AND date >= make_date($2, 1, 1) AND date < make_date($3 + 1, 1, 1)
+            """, currency_id, start_year, end_year)
+            if not row['days']:
+                return RateSeries.empty()
+            return RateSeries(np.array(row['days'], dtype="datetime64[D]"), row['values'])
+    except Exception as e:
+        logger.error(f"Error fetching history for {currency_id}: {e}")
+        return RateSeries.empty()
+
+
+async def create_chart_requests_table(pool):
+    """Создает таблицу 'chart_requests' со статистикой запросов графиков, если она не существует."""
+    try:
+        async with pool.acquire() as connection:
+            await connection.execute("""
+                CREATE TABLE IF NOT EXISTS chart_requests (
+                    currency_key TEXT NOT NULL,
+                    start_year INT NOT NULL,
+                    end_year INT NOT NULL,
+                    currencies JSONB NOT NULL,
+                    requests INT NOT NULL DEFAULT 1,
+                    last_requested TIMESTAMP NOT NULL DEFAULT now(),
+                    PRIMARY KEY (currency_key, start_year, end_year)
+                );
+            """)
+            logger.info("Table 'chart_requests' has been created or already exists.")
+    except Exception as e:
+        logger.error(f"Error creating table 'chart_requests': {e}")
+        raise
+
+
+async def record_chart_request(pool: asyncpg.Pool, selected_data, start_year: int, end_year: int) -> None:
+    """Учитывает запрос графика: набор валют (без учета порядка) и период."""
+    currencies = sorted(({"id": sd['id'], "charCode": sd['charCode']} for sd in selected_data),
+                        key=lambda sd: sd['id'])
+    currency_key = ",".join(sd['id'] for sd in currencies)
+    try:
+        async with pool.acquire() as connection:
+            await connection.execute("""
+                INSERT INTO chart_requests (currency_key, start_year, end_year, currencies)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (currency_key, start_year, end_year)
+                DO UPDATE SET requests = chart_requests.requests + 1, last_requested = now()
+            """, currency_key, start_year, end_year, currencies)
+    except Exception as e:
+        logger.error(f"Error recording chart request: {e}")
+
+
+async def get_top_chart_requests(pool: asyncpg.Pool, limit: int, days: int):
+    """
+    Самые частые запросы графиков среди запрошенных за последние days дней.
+
+    Returns:
+        list: [{"currencies": [{"id", "charCode"}], "start_year", "end_year", "requests"}].
+    """
+    try:
+        async with pool.acquire() as connection:
+            result = await connection.fetch("""
+                SELECT currencies, start_year, end_year, requests
+                FROM chart_requests
+                WHERE last_requested >= now() - make_interval(days => $2)
+                ORDER BY requests DESC, last_requested DESC
+                LIMIT $1
+            """, limit, days)
+            return [{
+                "currencies": row['currencies'],
+                "start_year": row['start_year'],
+                "end_year": row['end_year'],
+                "requests": row['requests'],
+            } for row in result]
+    except Exception as e:
+        logger.error(f"Error fetching top chart requests: {e}")
+        return []
+
+
+async def create_outbox_table(pool):
+    """
+    Создает таблицу 'outbox' исходящих сообщений, если она не существует.
+
+    Сообщение ждет отправки в статусе 'pending'; available_at — когда его можно
+    взять в работу (после захвата сдвигается на время аренды, после ошибки — на задержку повтора).
+    """
+    try:
+        async with pool.acquire() as connection:
+            await connection.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id BIGSERIAL PRIMARY KEY,
+                    idempotency_key TEXT NOT NULL UNIQUE,
+                    kind TEXT NOT NULL,
+                    user_id BIGINT NOT NULL,
+                    text TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INT NOT NULL DEFAULT 0,
+                    available_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    sent_at TIMESTAMPTZ,
+                    error TEXT
+                );
+                CREATE INDEX IF NOT EXISTS outbox_pending_idx ON outbox (available_at, id) WHERE status = 'pending';
+            """)
+            logger.info("Table 'outbox' has been created or already exists.")
+    except Exception as e:
+        logger.error(f"Error creating table 'outbox': {e}")
+        raise
+
+
+async def enqueue_outbox(pool: asyncpg.Pool, kind: str, messages) -> int:
+    """
+    Ставит сообщения в outbox одним COPY.
+
+    Args:
+        kind: Тип сообщений ('rates' — рассылка курсов).
+        messages: Тройки (idempotency_key, user_id, текст). Ключ, уже бывший в outbox, пропускается.
+
+    Returns:
+        int: Количество новых сообщений.
+    """
+    if not messages:
+        return 0
+    try:
+        async with pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.execute("""
+                    CREATE TEMP TABLE outbox_load (idempotency_key TEXT, user_id BIGINT, text TEXT) ON COMMIT DROP
+                """)
+                await connection.copy_records_to_table(
+                    "outbox_load", records=messages, columns=["idempotency_key", "user_id", "text"]
+                )
+                result = await connection.execute("""
+                    INSERT INTO outbox (idempotency_key, kind, user_id, text)
+                    SELECT idempotency_key, $1, user_id, text FROM outbox_load
+                    ON CONFLICT (idempotency_key) DO NOTHING
+                """, kind)
+        return int(result.split()[-1])
+    except Exception as e:
+        logger.error(f"Error enqueueing outbox messages: {e}")
+        raise
+
+
+async def claim_outbox(pool: asyncpg.Pool, limit: int, lease_seconds: float):
+    """
+    Берет в работу до limit готовых к отправке сообщений.
+
+    Захваченные строки не видны другим обработчикам lease_seconds секунд; если
+    статус за это время не записан (например, процесс упал), сообщение отправится снова.
+
+    Returns:
+        list: Записи (id, kind, user_id, text, attempts, created_at).
+    """
+    async with pool.acquire() as connection:
+        return await connection.fetch("""
+            UPDATE outbox o
+            SET available_at = now() + make_interval(secs => $2), attempts = o.attempts + 1
+            FROM (
+                SELECT id FROM outbox
+                WHERE status = 'pending' AND available_at <= now()
+                ORDER BY available_at, id
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            ) ready
+            WHERE o.id = ready.id
+            RETURNING o.id, o.kind, o.user_id, o.text, o.attempts, o.created_at
+        """, limit, lease_seconds)
+
+
+async def complete_outbox(pool: asyncpg.Pool, sent_ids, retry_ids, failed, retry_delay: float):
+    """
+    Записывает итоги отправки пачки сообщений одним запросом.
+
+    Для отправленных рассылок курсов в том же запросе обновляется last_course_data,
+    поэтому сохраненный текст всегда совпадает с доставленным.
+
+    Args:
+        sent_ids: id доставленных сообщений.
+        retry_ids: id сообщений для повтора; задержка retry_delay удваивается с каждой попыткой (до часа).
+        failed: Пары (id, текст ошибки) окончательно неотправляемых сообщений.
+    """
+    failed_ids = [message_id for message_id, _ in failed]
+    errors = [error for _, error in failed]
+    async with pool.acquire() as connection:
+        user_ids = await connection.fetchval("""
+            WITH sent AS (
+                UPDATE outbox SET status = 'sent', sent_at = now()
+                WHERE id = ANY($1::bigint[]) AND status = 'pending'
+                RETURNING id, kind, user_id, text
+            ), course AS (
+                UPDATE subscription s SET last_course_data = l.text, updated_at = now()
+                FROM (
+                    SELECT DISTINCT ON (user_id) user_id, text FROM sent
+                    WHERE kind = 'rates'
+                    ORDER BY user_id, id DESC
+                ) l
+                WHERE s.user_id = l.user_id
+                RETURNING s.user_id
+            ), retry AS (
+                UPDATE outbox
+                SET available_at = now() + make_interval(secs => LEAST($3 * power(2, attempts - 1), 3600))
+                WHERE id = ANY($2::bigint[]) AND status = 'pending'
+            ), failed AS (
+                UPDATE outbox o SET status = 'failed', error = f.error
+                FROM unnest($4::bigint[], $5::text[]) AS f(id, error)
+                WHERE o.id = f.id AND o.status = 'pending'
+            )
+            SELECT coalesce(array_agg(user_id), '{}') FROM course
+        """, sent_ids, retry_ids, retry_delay, failed_ids, errors)
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+
+
+async def get_outbox_depth(pool: asyncpg.Pool) -> int:
+    """Количество сообщений, ожидающих отправки."""
+    async with pool.acquire() as connection:
+        return await connection.fetchval("SELECT count(*) FROM outbox WHERE status = 'pending'")
+
+
+async def purge_outbox(pool: asyncpg.Pool, days: int) -> None:
+    """
+    Удаляет обработанные сообщения старше days дней.
+
+    Ключи идемпотентности живут столько же: повторная постановка того же ключа позже уже не отсекается.
+    """
+    try:
+        async with pool.acquire() as connection:
+            result = await connection.execute("""
+                DELETE FROM outbox
+                WHERE status <> 'pending' AND created_at < now() - make_interval(days => $1)
+            """, days)
+            logger.info(f"Outbox purge: {result}")
+    except Exception as e:
+        logger.error(f"Error purging outbox: {e}")
+
+
+async def create_fsm_state_table(pool):
+    """Создает таблицы 'fsm_state' и 'fsm_lock' для FSM (database/fsm_storage.py), если их нет."""
+    try:
+        async with pool.acquire() as connection:
+            await connection.execute("""
+                CREATE TABLE IF NOT EXISTS fsm_state (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data BYTEA,
+                    expires_at TIMESTAMPTZ NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS fsm_state_expires_idx ON fsm_state (expires_at);
+
+                -- Аренда ключа FSM процессом, обрабатывающим апдейт (PostgresEventIsolation)
+                CREATE TABLE IF NOT EXISTS fsm_lock (
+                    key TEXT PRIMARY KEY,
+                    owner UUID NOT NULL,
+                    expires_at TIMESTAMPTZ NOT NULL
+                );
+            """)
+            logger.info("Tables 'fsm_state', 'fsm_lock' have been created or already exist.")
+    except Exception as e:
+        logger.error(f"Error creating table 'fsm_state': {e}")
+        raise
+
+
+async def purge_fsm_state(pool: asyncpg.Pool) -> None:
+    """Удаляет истекшие состояния FSM (они уже не читаются, но занимают место) и брошенные аренды."""
+    try:
+        async with pool.acquire() as connection:
+            result = await connection.execute(
+                "DELETE FROM fsm_state WHERE expires_at <= now() OR (state IS NULL AND data IS NULL)"
+            )
+            await connection.execute("DELETE FROM fsm_lock WHERE expires_at <= now()")
+            logger.info(f"FSM state purge: {result}")
+    except Exception as e:
+        logger.error(f"Error purging FSM state: {e}")
@@ -0,0 +1,231 @@
+import asyncio
+import marshal
+import os
+import uuid
+import zlib
+from contextlib import asynccontextmanager
+
+import asyncpg
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage, StorageKey
+
+from logger.logging_settings import logger
+
+# Состояние, не менявшееся дольше этого срока, считается брошенным и не читается
+FSM_TTL = int(os.getenv("FSM_TTL", 24 * 3600))
+COMPRESS_FROM = 256  # Данные длиннее стольких байт сжимаются
+# Аренда ключа FSM на время обработки апдейта: продлевается, пока обработчик работает,
+# и истекает сама, если процесс упал
+LOCK_LEASE = float(os.getenv("FSM_LOCK_LEASE", 30))
+LOCK_RETRY_MIN = 0.01  # Ожидание освобождения ключа другим процессом, с удвоением
+LOCK_RETRY_MAX = 0.5
+
+_UNSET = object()
+
+
+def encode_data(data):
+    """
+    Кодирует данные FSM в компактный бинарный вид (marshal, крупные — еще и zlib).
+
+    marshal сохраняет set и нестроковые ключи словарей, которые хранят обработчики.
+    Пустые данные хранятся как NULL.
+    """
+    if not data:
+        return None
+    raw = marshal.dumps(dict(data), 4)
+    if len(raw) >= COMPRESS_FROM:
+        return b"z" + zlib.compress(raw)
+    return b"m" + raw
+
+
+def decode_data(blob):
+    if blob is None:
+        return {}
+    blob = bytes(blob)
+    raw = zlib.decompress(blob[1:]) if blob[:1] == b"z" else blob[1:]
+    return marshal.loads(raw)
+
+
+def storage_key(key: StorageKey) -> str:
+    return ":".join(str(part) if part is not None else "" for part in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+    ))
+
+
+class PostgresStorage(BaseStorage):
+    """
+    Хранилище FSM aiogram в таблице fsm_state общей базы.
+
+    Состояние переживает перезапуск и видно всем процессам бота. Пока апдейт
+    обрабатывается под PostgresEventIsolation, записи ключа (например, state.clear() —
+    это и состояние, и данные) копятся в памяти, читаются оттуда же и уходят в базу
+    одним запросом вместе со снятием аренды. Поэтому следующий апдейт пользователя
+    в любом процессе прочитает уже новые значения. Записи вне изоляции пишутся сразу.
+    """
+
+    def __init__(self, pool: asyncpg.Pool, ttl=FSM_TTL):
+        self.pool = pool
+        self.ttl = ttl
+        self._units = {}  # {ключ: [state, data]} обрабатываемых апдейтов, _UNSET — поле не менялось
+
+    def begin(self, name):
+        """Начинает копить записи ключа name (вызывает PostgresEventIsolation)."""
+        self._units[name] = [_UNSET, _UNSET]
+
+    async def commit(self, name, owner=None):
+        """Записывает накопленное для ключа name и снимает аренду owner одним запросом."""
+        state, data = self._units.pop(name, (_UNSET, _UNSET))
+        await self._save(name, state, data, owner)
+
+    async def _save(self, name, state=_UNSET, data=_UNSET, owner=None):
+        async with self.pool.acquire() as connection:
+            if state is _UNSET and data is _UNSET:
+                await connection.execute("DELETE FROM fsm_lock WHERE key = $1 AND owner = $2", name, owner)
+            elif state is None and data is None:
+                await connection.execute("""
+                    WITH cleared AS (DELETE FROM fsm_state WHERE key = $1)
+                    DELETE FROM fsm_lock WHERE key = $1 AND owner = $2
+                """, name, owner)
+            else:
+                # Неизмененное поле остается прежним, если запись еще не истекла
+                await connection.execute("""
+                    WITH saved AS (
+                        INSERT INTO fsm_state (key, state, data, expires_at)
+                        VALUES ($1, $2, $3, now() + make_interval(secs => $6))
+                        ON CONFLICT (key) DO UPDATE SET
+                            state = CASE WHEN $4 THEN EXCLUDED.state
+                                         WHEN fsm_state.expires_at > now() THEN fsm_state.state END,
+                            data = CASE WHEN $5 THEN EXCLUDED.data
+                                        WHEN fsm_state.expires_at > now() THEN fsm_state.data END,
+                            expires_at = EXCLUDED.expires_at
+                    )
+                    DELETE FROM fsm_lock WHERE key = $1 AND owner = $7
+                """, name, None if state is _UNSET else state, None if data is _UNSET else data,
+                    state is not _UNSET, data is not _UNSET, float(self.ttl), owner)
+
+    async def _write(self, key, state=_UNSET, data=_UNSET):
+        entry = self._units.get(storage_key(key))
+        if entry is None:
+            try:
+                await self._save(storage_key(key), state, data)
+            except Exception as e:
+                logger.error(f"Error writing FSM state {storage_key(key)}: {e}")
+                raise
+            return
+        if state is not _UNSET:
+            entry[0] = state
+        if data is not _UNSET:
+            entry[1] = data
+
+    async def _read(self, key, column):
+        # Измененное за время апдейта поле читается из накопленных записей
+        entry = self._units.get(storage_key(key))
+        value = _UNSET if entry is None else entry[1 if column == "data" else 0]
+        if value is not _UNSET:
+            return value
+        async with self.pool.acquire() as connection:
+            return await connection.fetchval(
+                f"SELECT {column} FROM fsm_state WHERE key = $1 AND expires_at > now()", storage_key(key)
+            )
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        await self._write(key, state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey):
+        return await self._read(key, "state")
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        await self._write(key, data=encode_data(data))
+
+    async def get_data(self, key: StorageKey):
+        return decode_data(await self._read(key, "data"))
+
+    async def close(self) -> None:
+        self._units.clear()
+
+
+class PostgresEventIsolation(BaseEventIsolation):
+    """
+    Изоляция апдейтов одного пользователя между всеми процессами бота.
+
+    Апдейты с одним ключом FSM обрабатываются строго по очереди: внутри процесса
+    их упорядочивает asyncio.Lock, между процессами — аренда ключа в таблице
+    fsm_lock. Иначе два быстрых нажатия на кнопки валют прочитали бы одно и то
+    же старое состояние, и второе сохранение затерло бы первое.
+
+    Аренда берется, продлевается и снимается короткими запросами через общий пул:
+    соединение на время обработчика не держится, и медленные обработчики одних
+    пользователей не задерживают апдейты других. Записи FSM за время обработки
+    сохраняются вместе со снятием аренды (PostgresStorage.commit).
+    """
+
+    def __init__(self, storage: PostgresStorage, lease=LOCK_LEASE):
+        self.storage = storage
+        self.pool = storage.pool
+        self.lease = lease
+        self._locks = {}  # {ключ: [asyncio.Lock, число ожидающих и держащих]}
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey):
+        name = storage_key(key)
+        entry = self._locks.setdefault(name, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                owner = await self._acquire(name)
+                renewal = asyncio.ensure_future(self._renew(name, owner))
+                self.storage.begin(name)
+                try:
+                    yield
+                finally:
+                    renewal.cancel()
+                    await self._commit(name, owner)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[name]
+
+    async def _acquire(self, name):
+        owner = uuid.uuid4()
+        delay = LOCK_RETRY_MIN
+        while True:
+            async with self.pool.acquire() as connection:
+                # Строка вставляется, если ключ свободен, или перехватывается, если аренда истекла
+                locked = await connection.fetchval("""
+                    INSERT INTO fsm_lock (key, owner, expires_at) VALUES ($1, $2, now() + make_interval(secs => $3))
+                    ON CONFLICT (key) DO UPDATE SET owner = EXCLUDED.owner, expires_at = EXCLUDED.expires_at
+                    WHERE fsm_lock.expires_at <= now()
+                    RETURNING TRUE
+                """, name, owner, float(self.lease))
+            if locked:
+                return owner
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LOCK_RETRY_MAX)
+
+    async def _renew(self, name, owner):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                async with self.pool.acquire() as connection:
+                    await connection.execute("""
+                        UPDATE fsm_lock SET expires_at = now() + make_interval(secs => $3)
+                        WHERE key = $1 AND owner = $2
+                    """, name, owner, float(self.lease))
+            except Exception as e:
+                logger.error(f"Error renewing FSM lock {name}: {e}")
+
+    async def _commit(self, name, owner):
+        try:
+            await self.storage.commit(name, owner)
+        except Exception as e:
+            logger.error(f"Error writing FSM state {name}: {e}")
+            try:
+                async with self.pool.acquire() as connection:
+                    await connection.execute("DELETE FROM fsm_lock WHERE key = $1 AND owner = $2", name, owner)
+            except Exception as e:
+                # Ключ освободится по истечении аренды
+                logger.error(f"Error releasing FSM lock {name}: {e}")
+            raise
+
+    async def close(self) -> None:
+        self._locks.clear()
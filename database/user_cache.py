@@ -0,0 +1,93 @@
+import os
+import time
+from collections import OrderedDict
+
+from service.metrics import Counter
+
+# Сколько профилей держать в памяти и сколько секунд им доверять
+MAX_ENTRIES = int(os.getenv("USER_CACHE_SIZE", 10000))
+TTL = float(os.getenv("USER_CACHE_TTL", 300))
+
+user_cache_requests = Counter("user_cache_requests_total", "Чтения профиля пользователя: hit — из кэша, miss — из БД")
+
+
+class UserProfileCache:
+    """
+    Кэш профилей пользователей (UserProfile) в памяти процесса: LRU + TTL.
+
+    Читается перед запросом в БД, любая запись профиля через database/db.py
+    обновляет или сбрасывает запись. Записи других процессов бота приходят
+    уведомлениями из БД (database/db.listen_profile_changes); пока слушатель
+    не подключен, кэш отключен (suspend/resume). Профили из кэша общие,
+    изменять их на месте нельзя — только через update_user_profile.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # {user_id: (expires_at, UserProfile)}
+        # Номера сбросов: чтение из БД, начатое до сброса профиля, не попадает в кэш.
+        # Сбросы помнятся по пользователям, чтобы запись одного не отбрасывала чтения остальных
+        self._generation = 0
+        self._invalidated = OrderedDict()  # {user_id: номер последнего сброса}
+        self._floor = 0  # Сбросы старше этого номера забыты и считаются сбросом всех
+        self._active = True
+
+    def get(self, user_id):
+        entry = self._entries.get(user_id) if self._active else None
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(user_id, None)
+            user_cache_requests.inc(result="miss")
+            return None
+        self._entries.move_to_end(user_id)
+        user_cache_requests.inc(result="hit")
+        return entry[1]
+
+    def generation(self):
+        """Отметка перед чтением из БД, передается в put()."""
+        return self._generation
+
+    def put(self, user_id, profile, generation=None):
+        """Запоминает профиль. С generation — только если с тех пор профиль не сбрасывался."""
+        if not self._active:
+            return
+        if generation is not None and max(self._floor, self._invalidated.get(user_id, 0)) > generation:
+            return
+        self._entries[user_id] = (time.monotonic() + self.ttl, profile)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        """Сбрасывает профиль пользователя (или все профили) после записи в БД."""
+        self._generation += 1
+        if user_id is None:
+            self._entries.clear()
+            self._invalidated.clear()
+            self._floor = self._generation
+            return
+        self._entries.pop(user_id, None)
+        self._invalidated[user_id] = self._generation
+        self._invalidated.move_to_end(user_id)
+        while len(self._invalidated) > self.max_entries:
+            _, forgotten = self._invalidated.popitem(last=False)
+            self._floor = max(self._floor, forgotten)
+
+    def suspend(self):
+        """Отключает кэш: изменения из других процессов могут не дойти."""
+        self._active = False
+        self.invalidate()
+
+    def resume(self):
+        """Включает кэш с нуля, когда изменения снова приходят."""
+        self.invalidate()
+        self._active = True
+
+    def hit_rate(self):
+        hits = user_cache_requests.value(result="hit")
+        total = hits + user_cache_requests.value(result="miss")
+        return hits / total if total else 0.0
+
+
+# Общий кэш профилей процесса
+user_cache = UserProfileCache()
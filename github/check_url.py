@@ -1,31 +1,102 @@
 import asyncio
+import os
+import time
 
 import aiohttp
 
+from logger.logging_settings import logger
+from service.metrics import Counter, Histogram
 
-async def check_file_available(url, retries=10, delay=5):
+# Сколько всего ждать появления файла (раньше: 10 попыток по 5 секунд)
+AVAILABLE_TIMEOUT = float(os.getenv("CHART_AVAILABLE_TIMEOUT", 50))
+FIRST_DELAY = 0.25  # Первая пауза между проверками, дальше удваивается
+MAX_DELAY = 4.0
+REQUEST_TIMEOUT = 5
+
+time_to_available = Histogram(
+    "chart_time_to_available_seconds",
+    "Время от готовности ссылки на график до ее доступности",
+    buckets=[0.1, 0.5, 1, 2, 5, 10, 20, 30, 50],
+)
+unavailable_total = Counter("chart_unavailable_total", "Графики, не ставшие доступными за отведенное время")
+
+_session = None
+_waiting = {}  # {url: задача проверки} — одна проверка на ссылку для всех пользователей
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Общая сессия для проверок доступности."""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+async def _poll(url, timeout):
+    session = get_session()
+    deadline = time.monotonic() + timeout
+    delay = FIRST_DELAY
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            async with session.head(url, allow_redirects=True) as response:
+                if response.status == 200:
+                    return True
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Ошибка запроса {url}: {e}")
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.info(f"Файл {url} не появился за {timeout} сек. ({attempt} попыток)")
+            return False
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, MAX_DELAY)
+
+
+async def check_file_available(url, timeout=AVAILABLE_TIMEOUT):
     """
-    Проверяет доступность файла по URL. Если файл не найден (404),
-    делает повторные попытки с задержкой.
+    Ждет, пока файл станет доступен по URL: HEAD-запросы с паузами
+    0.25, 0.5, 1, 2, 4, 4... сек. до истечения timeout.
 
     Args:
         url (str): URL файла.
-        retries (int): Количество повторных попыток (по умолчанию 10).
-        delay (int): Задержка между попытками в секундах (по умолчанию 5).
+        timeout (float): Сколько всего ждать, сек.
 
     Returns:
-        bool: True, если файл доступен, False после всех попыток.
+        bool: True, если файл доступен, False по истечении времени.
+    """
+    started = time.monotonic()
+    task = _waiting.get(url)
+    if task is None:
+        task = asyncio.create_task(_poll(url, timeout))
+        _waiting[url] = task
+        task.add_done_callback(lambda _: _waiting.pop(url, None))
+
+    available = await asyncio.shield(task)
+    if available:
+        time_to_available.observe(time.monotonic() - started)
+    else:
+        unavailable_total.inc()
+    return available
+
+
+async def chart_available(chart):
+    """
+    Готов ли график для пользователя. Если публикация уже подтвердила, что
+    файл доступен (встроенный сервер), проверять нечего; иначе ждем его по сети.
     """
-    async with aiohttp.ClientSession() as session:
-        for attempt in range(retries):
-            try:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        return True  # Файл найден
-            except Exception as e:
-                print(f"Ошибка запроса: {e}")
-
-            print(f"Попытка {attempt + 1}/{retries}: Файл не найден, ждем {delay} сек...")
-            await asyncio.sleep(delay)
-
-    return False  # Файл не найден после всех попыток
+    if not chart['published']:
+        unavailable_total.inc()
+        return False
+    if chart['live']:
+        time_to_available.observe(0)
+        return True
+    return await check_file_available(chart.get('check_url', chart['url']))
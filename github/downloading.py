@@ -1,15 +1,34 @@
 import asyncio
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message
 
+# Правка сообщения расходует лимит чата (service/send_limiter.py), поэтому точки
+# обновляются не чаще раза в 1.5 секунды, а анимация ограничена по времени
+FRAME_INTERVAL = 1.5
+MAX_FRAMES = 40  # Около минуты
 
-async def send_loading_message(message: Message):
+
+async def send_loading_message(message: Message, status=None):
     """
     Отправляет пользователю сообщение с анимацией "бегающих точек" (Подождите, рисуем графики...)
+    Анимация идет, пока задачу не отменят, но не дольше MAX_FRAMES кадров. Если в status есть
+    место в очереди графиков (status['position'] > 0), оно показывается в сообщении.
     """
     text = "Подождите, рисуем графики"
     msg = await message.answer(text)  # Отправляем начальное сообщение
 
-    for _ in range(10):  # 10 секунд анимации
-        for dots in [".", "..", "...", ""]:
-            await asyncio.sleep(0.4)  # Ждем 1 секунду
-            await msg.edit_text(f"{text}{dots}")  # Обновляем текст
+    shown = text
+    for frame in range(MAX_FRAMES):
+        await asyncio.sleep(FRAME_INTERVAL)
+        position = (status or {}).get('position')
+        prefix = f"Вы {position}-й в очереди. " if position else ""
+        dots = [".", "..", "...", ""][frame % 4]
+        new_text = f"{prefix}{text}{dots}"
+        if new_text == shown:
+            continue
+        try:
+            await msg.edit_text(new_text)  # Обновляем текст
+        except TelegramBadRequest:
+            # Сообщение удалено или не изменилось — анимация просто заканчивается
+            return
+        shown = new_text
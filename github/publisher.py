@@ -0,0 +1,85 @@
+import asyncio
+import os
+
+from github.upload_to_github import upload_to_github
+from logger.logging_settings import logger
+
+# Сколько секунд собирать новые файлы в одну публикацию
+PUBLISH_WINDOW = float(os.getenv("PUBLISH_WINDOW", 2))
+
+
+class GithubPublisher:
+    """
+    Фоновая публикация графиков на GitHub Pages.
+
+    Файлы, поступившие в течение window секунд после первого, уходят одним
+    коммитом и одним push в отдельном потоке. Каждый вызов publish() ждет
+    только результат публикации своего файла.
+    """
+
+    # После push GitHub Pages еще пересобирает сайт: доступность ссылки проверяется отдельно
+    live = False
+
+    def __init__(self, window=PUBLISH_WINDOW, upload=upload_to_github):
+        self.window = window
+        self._upload = upload
+        self._queue = None
+        self._worker = None
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def publish(self, file_path) -> bool:
+        """Ставит файл в очередь на публикацию и ждет ее результата."""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((file_path, future))
+        return await future
+
+    async def _collect(self):
+        """Первый файл из очереди и все, что успело прийти за окно."""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.window
+        while (timeout := deadline - loop.time()) > 0:
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch = await self._collect()
+            # None — сигнал остановки от close(): публикуем то, что уже собрано, и выходим
+            stopping = None in batch
+            batch = [item for item in batch if item is not None]
+            if not batch:
+                continue
+            try:
+                published = await asyncio.to_thread(self._upload)
+            except Exception as e:
+                logger.error(f"Ошибка публикации: {e}")
+                published = False
+            logger.info(f"Publish: {len(batch)} files, {'ok' if published else 'failed'}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(published)
+
+    async def close(self, timeout=60):
+        """Публикует уже поставленные в очередь файлы и останавливает фоновую задачу."""
+        if self._worker is None or self._worker.done():
+            return
+        await self._queue.put(None)
+        try:
+            await asyncio.wait_for(self._worker, timeout)
+        except asyncio.TimeoutError:
+            logger.error("Publish: не дождались завершения публикации")
+        self._worker = None
+
+
+# Общий публикатор приложения
+publisher = GithubPublisher()
@@ -0,0 +1,64 @@
+# broadcast.py
+from database.db import enqueue_outbox, get_subscribers
+from logger.logging_settings import logger
+from service.CbRF import format_course, parse_course_text
+from service.outbox import outbox
+
+# Дата последней разосланной публикации (ДД.ММ.ГГГГ)
+last_published = None
+
+
+def build_message(snapshot, selected_data, day, last_course_data):
+    """
+    Сравнивает курсы выбранных валют с последним отправленным текстом.
+
+    Returns:
+        str | None: Текст рассылки или None, если курсы не изменились.
+    """
+    target_ids = {item["id"] for item in selected_data if isinstance(item, dict) and "id" in item}
+    last = parse_course_text(last_course_data)
+
+    has_changes = False
+    for valute_id in target_ids:
+        valute = snapshot.valutes.get(valute_id)
+        if valute is None:
+            logger.error(f"Курс {valute_id} не найден!")
+            continue
+        if last.get(valute.name) != valute.rate:
+            has_changes = True
+            break
+
+    if not has_changes:
+        return None
+    return format_course(snapshot, target_ids, day)
+
+
+async def broadcast_rates(pool, snapshot):
+    """
+    Рассылает новую публикацию курсов ЦБ всем подписчикам.
+
+    Вызывается наблюдателем публикаций с уже загруженным снимком; подписчики
+    читаются одним запросом, изменения считаются в памяти. Сообщения ставятся
+    в outbox с ключом публикация+пользователь, поэтому повторная рассылка той же
+    публикации (в том числе после перезапуска) не создает дублей.
+
+    Returns:
+        int: Количество новых сообщений в outbox.
+    """
+    global last_published
+    if snapshot.date == last_published:
+        return 0
+    day = snapshot.date.replace(".", "/")
+
+    subscribers = await get_subscribers(pool)
+    messages = []
+    for subscriber in subscribers:
+        text = build_message(snapshot, subscriber["currency_data"], day, subscriber["last_course_data"])
+        if text is not None:
+            messages.append((f"rates:{snapshot.date}:{subscriber['user_id']}", subscriber["user_id"], text))
+
+    queued = await enqueue_outbox(pool, "rates", messages)
+    outbox.wake()
+    last_published = snapshot.date
+    logger.info(f"Broadcast {snapshot.date}: {queued}/{len(messages)} queued, {len(subscribers)} subscribers")
+    return queued
@@ -1,9 +1,9 @@
 # user_handlers.py
 import asyncio
 import datetime
-import json
 import os
 
+import asyncpg
 from aiogram import Router, F
 from aiogram.enums import ContentType
 from aiogram.filters import Command, StateFilter
@@ -14,19 +14,18 @@ from aiogram.types import Message
 from aiogram.types.web_app_info import WebAppInfo
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from database.db import create_db_pool, create_table, get_everyday, get_selected_currency, \
-    format_currency_from_db, update_user_everyday, add_user_to_db, update_user_currency, update_user_jobs, \
-    get_user_jobs, get_last_course_data, update_last_course_data
-from github.check_url import check_file_available
+from database.db import get_selected_currency, format_currency_from_db, add_user_to_db, get_user_profile, \
+    update_user_profile, record_chart_request
+from github.check_url import chart_available
 from github.downloading import send_loading_message
-from handlers.notifications import schedule_interval_greeting
 from handlers.selected_currency import update_selected_currency, load_currency_data
 from keyboards.buttons import create_inline_kb, keyboard_with_pagination_and_selection
 from lexicon.lexicon import CURRENCY, \
     LEXICON_GLOBAL, LEXICON_IN_MESSAGE
 from logger.logging_settings import logger
 from parsing.bank import get_city_link
-from service.CbRF import course_today, dinamic_course, parse_xml_data, categorize_currencies, graf_mobile
+from service.CbRF import course_today
+from service.chart_jobs import ChartQueueFull, build_user_charts, chart_job_key, chart_queue
 from service.geocoding import get_city_by_coordinates
 from states.state import UserState
 
@@ -41,23 +40,13 @@ def set_scheduler(sched: AsyncIOScheduler):
     scheduler = sched
 
 
-# Инициализируем пул подключений к базе данных
-db_pool = None
-
-
-async def init_db():
-    global db_pool
-    db_pool = await create_db_pool()
-    await create_table(db_pool)
-
-
 def get_lexicon_data(command: str):
     """Получаем данные из LEXICON_GLOBAL по команде."""
     return next((item for item in LEXICON_GLOBAL if item["command"] == command), None)
 
 
 @router.message(Command(commands="start"), StateFilter(default_state))
-async def process_start_handler(message: Message, state: FSMContext):
+async def process_start_handler(message: Message, state: FSMContext, db_pool: asyncpg.Pool):
     """Обработчик команды /start."""
     await state.clear()
     start_data = get_lexicon_data("start")
@@ -89,14 +78,15 @@ async def process_start_handler(message: Message, state: FSMContext):
 
 
 @router.message(Command(commands=["currency"]))
-async def my_currency(message: Message, state: FSMContext):
+async def my_currency(message: Message, state: FSMContext, db_pool: asyncpg.Pool):
     await state.clear()
     user_id = message.from_user.id
     currency_file_path = os.path.join(os.path.dirname(__file__), '../save_files/currency_code.json')
     currency_data = load_currency_data(currency_file_path)
 
-    # Получаем данные из базы данных
-    db_result = await get_selected_currency(db_pool, user_id)
+    # Получаем все нужные данные пользователя одним запросом
+    profile = await get_user_profile(db_pool, user_id)
+    db_result = profile.currency_data if profile else []
     # logger.info(f"db_result: {db_result}")
 
     # Форматируем результат
@@ -115,8 +105,7 @@ async def my_currency(message: Message, state: FSMContext):
         item = next((item for item in LEXICON_GLOBAL if item["command"] == button_data["command"]), None)
         if item:
             if item["command"] in ["everyday"]:
-                everyday = await get_everyday(db_pool, user_id)
-                btn_key = "btn2" if everyday == True else "btn1"  # Выбираем кнопку в зависимости от состояния
+                btn_key = "btn2" if profile and profile.everyday else "btn1"  # Выбираем кнопку в зависимости от состояния
                 btn_text = item.get(btn_key, button_data.get(btn_key))
             else:
                 btn_text = item.get("btn", button_data.get("btn"))
@@ -219,7 +208,7 @@ async def handle_toggle_and_pagination(callback: CallbackQuery, state: FSMContex
 
 
 @router.callback_query(F.data == "last_btn")
-async def handle_last_btn(callback: CallbackQuery, state: FSMContext):
+async def handle_last_btn(callback: CallbackQuery, state: FSMContext, db_pool: asyncpg.Pool):
     """Обработчик последней кнопки."""
     user_id = callback.from_user.id
     select_rate_data = next((item for item in LEXICON_GLOBAL if item["command"] == "select_rate"), None)
@@ -234,9 +223,24 @@ async def handle_last_btn(callback: CallbackQuery, state: FSMContext):
         await callback.message.answer(select_rate_data["notification_false"])
     else:
         logger.info(f'User {user_id} has been selected currency: {selected_names}')
-        await update_user_currency(db_pool, user_id, selected_names)
         await callback.answer('')
 
+        # Путь к файлу (можно использовать абсолютный путь)
+        currency_file_path = os.path.join(os.path.dirname(__file__), '../save_files/currency_code.json')
+
+        # Загрузка данных о валютах и замена названий на записи из currency_code.json
+        currency_data = load_currency_data(currency_file_path)
+        updated_currencies = update_selected_currency(list(selected_names), user_id, currency_data)
+
+        # Валюты сохраняются одним запросом, он же возвращает подписку
+        try:
+            profile = await update_user_profile(db_pool, user_id, currency_data=updated_currencies)
+        except Exception as e:
+            logger.error(e)
+            await callback.message.answer("Не удалось сохранить выбранные валюты. Попробуйте еще раз.")
+            return
+        everyday = profile.everyday if profile else False
+
         # Создаем клавиатуру с кнопками из LEXICON_GLOBAL
         keyboard = InlineKeyboardMarkup(inline_keyboard=[])
 
@@ -244,8 +248,7 @@ async def handle_last_btn(callback: CallbackQuery, state: FSMContext):
             item = next((item for item in LEXICON_GLOBAL if item["command"] == button_data["command"]), None)
             if item:
                 if item["command"] in ["everyday"]:
-                    everyday = await get_everyday(db_pool, user_id)
-                    btn_key = "btn2" if everyday == True else "btn1"  # Выбираем кнопку в зависимости от состояния
+                    btn_key = "btn2" if everyday else "btn1"  # Выбираем кнопку в зависимости от состояния
                     btn_text = item.get(btn_key, button_data.get(btn_key))
                 else:
                     btn_text = item.get("btn", button_data.get("btn"))
@@ -258,78 +261,23 @@ async def handle_last_btn(callback: CallbackQuery, state: FSMContext):
         await callback.message.answer(f"{select_rate_data['notification_true']}\n{chr(10).join(selected_names)}",
                                       reply_markup=keyboard)
 
-        # Путь к файлу (можно использовать абсолютный путь)
-        currency_file_path = os.path.join(os.path.dirname(__file__), '../save_files/currency_code.json')
-
-        # Загрузка данных о валютах
-        currency_data = load_currency_data(currency_file_path)
-        # logger.info(f"state {state}")
-
-        db_result = await get_selected_currency(db_pool, user_id)
-        # logger.info(f"db_result {db_result}")
-        updated_currencies = update_selected_currency(db_result, user_id, currency_data)  # Обновляем user_dict
-
-        # Добавляем пользователя в базу данных
+        # Последний курс запоминается уже после ответа: запрос к ЦБ не задерживает подтверждение
         try:
-            await update_user_currency(db_pool, user_id, selected_currency=updated_currencies)
-            db_result = await get_selected_currency(db_pool, user_id)
-            formatted_result = await format_currency_from_db(db_result)
-            selected_data = await get_selected_currency(db_pool, user_id)
             today = datetime.date.today().strftime("%d/%m/%Y")  # Формат: ДД/ММ/ГГГГ
-            await update_last_course_data(db_pool, user_id, course_today(selected_data, today))
-
-            # Проверяем, подписан ли пользователь на рассылку
-            subscription = await get_everyday(db_pool, user_id)
-
-            try:
-                if subscription:
-                    text = get_lexicon_data("everyday")['notification_false']
-                    # Получаем список задач пользователя
-                    jobs = await get_user_jobs(db_pool, user_id)
-
-                    # Отменяем каждую задачу из списка
-                    for job_id in jobs:
-                        if scheduler.get_job(job_id):
-                            try:
-                                scheduler.remove_job(job_id)  # Удаляем задачу из планировщика
-                                logger.info(f"Jobs from DB == {jobs}")
-                            except Exception as e:
-                                logger.error(e)
-                        else:
-                            logger.info(f'Scheduler has not found task "{job_id}"')
-
-                    # Обновляем статус подписки на False
-                    await update_user_jobs(db_pool, user_id, job_id=None)  # Очищаем список задач
-
-                    # Получаем выбранные валюты и текущую дату
-                    selected_data = await get_selected_currency(db_pool, user_id)
-                    today = datetime.date.today().strftime("%d/%m/%Y")
-
-                    # Проверка last_course_data в БД пользователя
-                    course_data = course_today(selected_data, today)
-                    await update_last_course_data(db_pool, user_id, course_data)
-                    last_course_data = await get_last_course_data(db_pool, user_id)
-                    single_line = " ".join(last_course_data.splitlines())
-                    logger.info(f'last course for user {user_id}: {single_line}')
-
-                    # Запланируем рассылку
-                    job_id = schedule_interval_greeting(user_id, scheduler, selected_data)
-                    await update_user_jobs(db_pool, user_id, job_id)  # Добавляем job_id в список задач
-                    jobs = await get_user_jobs(db_pool, user_id)
-                    logger.info(f"Scheduler was updated == {selected_data}")
-                    logger.info(f"Jobs from DB == {jobs}")
-                    logger.info(f"User {user_id} jobs == {scheduler.get_job(job_id)}")
-
-            except Exception as e:
-                logger.error(f"Error in send_today_schedule_handler: {e}")
-
+            course_data = await course_today(updated_currencies, today)
+            await update_user_profile(db_pool, user_id, last_course_data=course_data)
         except Exception as e:
-            logger.error(e)
+            logger.error(f"Error saving last course for user {user_id}: {e}")
+
+        # Подписчикам новые валюты придут со следующей рассылкой: broadcast_rates читает их из БД
+        if everyday:
+            formatted_result = await format_currency_from_db(updated_currencies)
+            logger.info(f'User {user_id} subscription now covers: {formatted_result}')
 
 
 @router.message(Command(commands=["today"]))
 @router.callback_query(lambda c: c.data == get_lexicon_data("today")["command"])
-async def send_today_handler(event: Message | CallbackQuery, state: FSMContext):
+async def send_today_handler(event: Message | CallbackQuery, state: FSMContext, db_pool: asyncpg.Pool):
     """
     Обработчик для вывода курса выбранных валют пользователем для текущего дня.
     Поддерживает как команду /today, так и callback от кнопки "Курс ЦБ сегодня".
@@ -337,31 +285,33 @@ async def send_today_handler(event: Message | CallbackQuery, state: FSMContext):
     try:
         await state.clear()
         user_id = event.from_user.id
-        selected_data = await get_selected_currency(db_pool, user_id)
+        profile = await get_user_profile(db_pool, user_id)
         today = datetime.date.today().strftime("%d/%m/%Y")  # Формат: ДД/ММ/ГГГГ
+        course_data = await course_today(profile.currency_data if profile else [], today)
         if isinstance(event, CallbackQuery):
             await event.answer('')
-            await event.message.answer(course_today(selected_data, today))
+            await event.message.answer(course_data)
         else:  # isinstance(event, Message)
-            await event.answer(course_today(selected_data, today))
-        await update_last_course_data(db_pool, user_id, course_today(selected_data, today))
+            await event.answer(course_data)
+        await update_user_profile(db_pool, user_id, last_course_data=course_data)
         logger.info(f"User {user_id} has selected the '/today' command'")
     except Exception as e:
         logger.error(e)
 
 
 @router.message(Command(commands=["everyday"]))
-async def everyday_handlers(message: Message, state: FSMContext):
+async def everyday_handlers(message: Message, state: FSMContext, db_pool: asyncpg.Pool):
     # Создаем клавиатуру с кнопками из LEXICON_GLOBAL
     await state.clear()
     user_id = message.from_user.id
     keyboard = InlineKeyboardMarkup(inline_keyboard=[])
+    profile = await get_user_profile(db_pool, user_id)
+    everyday = profile.everyday if profile else False
 
     for button_data in LEXICON_IN_MESSAGE:
         item = next((item for item in LEXICON_GLOBAL if item["command"] == button_data["command"]), None)
         if item:
             if item["command"] in ["everyday"]:
-                everyday = await get_everyday(db_pool, user_id)
                 btn_key = "btn2" if everyday else "btn1"  # Выбираем кнопку в зависимости от состояния
                 btn_answer = "Вы подписаны на ежедневную рассылку курса валют" if everyday else "Вы отписаны от ежедневной рассылки курса валют"
                 btn_text = item.get(btn_key, button_data.get(btn_key))
@@ -374,18 +324,19 @@ async def everyday_handlers(message: Message, state: FSMContext):
                 await message.answer(text=btn_answer, reply_markup=keyboard)
 
 @router.callback_query(lambda c: c.data == get_lexicon_data("everyday")["command"])
-async def send_today_schedule_handler(event: CallbackQuery, state: FSMContext):
+async def send_today_schedule_handler(event: CallbackQuery, state: FSMContext, db_pool: asyncpg.Pool):
     # Получаем user_id и сообщение из callback_query
     user_id = event.from_user.id
     message = event.message  # Используем message из callback_query
 
-    # Проверяем, подписан ли пользователь на рассылку
-    subscription = await get_everyday(db_pool, user_id)
+    # Подписка, задачи и валюты пользователя одним запросом
+    profile = await get_user_profile(db_pool, user_id)
+    subscription = profile.everyday if profile else False
 
     if subscription:
         text = get_lexicon_data("everyday")['notification_false']
         # Получаем список задач пользователя
-        jobs = await get_user_jobs(db_pool, user_id)
+        jobs = profile.jobs
 
         # Отменяем каждую задачу из списка
         for job_id in jobs:
@@ -398,9 +349,8 @@ async def send_today_schedule_handler(event: CallbackQuery, state: FSMContext):
             else:
                 logger.info(f'Scheduler has not found task "{job_id}"')
 
-        # Обновляем статус подписки на False
-        await update_user_everyday(db_pool, user_id, False)
-        await update_user_jobs(db_pool, user_id, job_id=None)  # Очищаем список задач
+        # Отключаем подписку и очищаем список задач одним запросом
+        await update_user_profile(db_pool, user_id, everyday=False, jobs=[])
 
         # Подтверждаем обработку callback_query
         await event.answer()
@@ -411,35 +361,24 @@ async def send_today_schedule_handler(event: CallbackQuery, state: FSMContext):
     else:
         # Если пользователь не подписан, подписываем его
         try:
-            await update_user_everyday(db_pool, user_id, True)
-            subscription = await get_everyday(db_pool, user_id)
-
-            # Получаем выбранные валюты и текущую дату
-            selected_data = await get_selected_currency(db_pool, user_id)
             today = datetime.date.today().strftime("%d/%m/%Y")
             # tomorrow = (datetime.date.today() + datetime.timedelta(days=1)).strftime("%d/%m/%Y")
 
             # Подтверждаем обработку callback_query
             await event.answer()
 
-            # Проверка last_course_data в БД пользователя
-            course_data = course_today(selected_data, today)
-            await update_last_course_data(db_pool, user_id, course_data)
-            last_course_data = await get_last_course_data(db_pool, user_id)
-            logger.info(f'last course for user {user_id}: {last_course_data}')
-
-            # Запланируем рассылку
-            job_id = schedule_interval_greeting(user_id, scheduler, selected_data)
-            await update_user_jobs(db_pool, user_id, job_id)  # Добавляем job_id в список задач
-            jobs = await get_user_jobs(db_pool, user_id)
-            logger.info(f"Jobs from DB == {jobs}")
-            logger.info(f"User {user_id} jobs == {scheduler.get_job(job_id)}")
+            # Текущий курс запоминается вместе с подпиской: рассылка придет при его изменении
+            # Если ЦБ недоступен, курс не запоминается, но подписка все равно включается
+            course_data = await course_today(profile.currency_data if profile else [], today)
+            profile = await update_user_profile(db_pool, user_id, everyday=True, last_course_data=course_data or '')
+            logger.info(f'last course for user {user_id}: {profile.last_course_data if profile else ""}')
 
             # Отправляем сообщение о включении рассылки
             await message.answer(text=get_lexicon_data("everyday")['notification_true'])
 
         except Exception as e:
             logger.error(f"Error in send_today_schedule_handler: {e}")
+            await message.answer(text="Не удалось включить рассылку. Попробуйте еще раз.")
 
 
 @router.message(F.content_type.in_({ContentType.PHOTO, ContentType.DOCUMENT, ContentType.VOICE, ContentType.VIDEO}))
@@ -484,7 +423,7 @@ async def in_banks(event: Message | CallbackQuery, state: FSMContext):
 
 
 @router.message(UserState.location)
-async def get_link_city(message: Message, state: FSMContext):
+async def get_link_city(message: Message, state: FSMContext, db_pool: asyncpg.Pool):
     # Проверяем, есть ли текст в сообщении
     if message.text and (message.text.startswith("/") or message.text.lower() in ["отмена", "cancel"]):
         await state.clear()
@@ -515,12 +454,7 @@ async def get_link_city(message: Message, state: FSMContext):
     }
 
     # Сохраняем в PostgreSQL
-    async with db_pool.acquire() as connection:
-        await connection.execute(
-            "UPDATE users SET location = $1 WHERE user_id = $2",
-            json.dumps(location_data, ensure_ascii=False),  # Преобразуем в JSON-строку
-            user_id
-        )
+    await update_user_profile(db_pool, user_id, location=location_data)
 
     logger.info(f"Локация пользователя {user_id} обновлена: {location_data}")
 
@@ -540,7 +474,7 @@ async def get_link_city(message: Message, state: FSMContext):
 
 
 @router.message(UserState.years)
-async def process_year(message: Message, state: FSMContext):
+async def process_year(message: Message, state: FSMContext, db_pool: asyncpg.Pool):
     """Обрабатывает введенный диапазон лет и выводит клавиатуру."""
     user_id = message.from_user.id
     user_dict = await state.get_data()
@@ -586,61 +520,69 @@ async def process_year(message: Message, state: FSMContext):
     # Сохраняем данные в state
     await state.update_data(start=start, end=end)
 
-    # Отправляем анимационное сообщение пользователю
-    loading_task = asyncio.create_task(send_loading_message(message))
-
     # Генерация данных для графика
     selected_data = await get_selected_currency(db_pool, user_id)
 
-    if selected_data is None:
+    if not selected_data:
         await message.answer("Ошибка: у вас нет выбранных валют.")
         return
 
-    selected_data_list = []
-    for sd in selected_data:
-        result = dinamic_course(sd['id'])
-        name = sd['charCode']
-        result_data = parse_xml_data(result)
-        selected_data_list.append({"name": name, "value": result_data})
-
-    group_for_graf = categorize_currencies(selected_data_list)
-    url = graf_mobile(group_for_graf, start, end)
-    logger.info(f'Сформирован график {url}')
+    # Статистика для ночной предотрисовки популярных графиков
+    await record_chart_request(db_pool, selected_data, start, end)
 
-    # Отправляем анимационное сообщение пользователю
-    # loading_task = asyncio.create_task(send_loading_message(message))
+    # Отправляем анимационное сообщение пользователю, в нем же — место в очереди графиков
+    loading_status = {'position': None}
+    loading_task = asyncio.create_task(send_loading_message(message, loading_status))
 
-    # Проверяем доступность файла
-    if await check_file_available(url):
-        await loading_task  # Дожидаемся окончания анимации
-
-        # Отправляем кнопки после загрузки
-        button_mobile = InlineKeyboardButton(
-            text="График на телефоне",
-            web_app=WebAppInfo(url=url)
-        )
-
-        button_pc = InlineKeyboardButton(
-            text="График на ПК",
-            url=url
+    try:
+        charts = await chart_queue.submit(
+            chart_job_key(selected_data, start, end),
+            lambda: build_user_charts(db_pool, selected_data, start, end),
+            on_position=lambda position: loading_status.update(position=position)
         )
+    except ChartQueueFull:
+        loading_task.cancel()
+        await message.answer("Сейчас строится слишком много графиков. Попробуйте через минуту.")
+        logger.info(f"Очередь графиков переполнена, запрос пользователя {user_id} отклонен")
+        return
+    except Exception as e:
+        logger.error(f"Ошибка построения графика для пользователя {user_id}: {e}")
+        charts = []
+    logger.info(f'Сформированы графики {[chart["url"] for chart in charts]}')
+
+    # Ждем доступности файлов всех групп одновременно
+    available = await asyncio.gather(*(chart_available(chart) for chart in charts))
+    ready = [chart for chart, is_available in zip(charts, available) if is_available]
+    loading_task.cancel()  # Останавливаем анимацию
+
+    if ready:
+        # Отправляем кнопки после загрузки: по паре кнопок на каждую группу валют
+        inline_keyboard = []
+        for chart in ready:
+            suffix = f" ({chart['names']})" if len(charts) > 1 else ""
+            button_mobile = InlineKeyboardButton(
+                text=f"График на телефоне{suffix}",
+                web_app=WebAppInfo(url=chart['url'])
+            )
+
+            button_pc = InlineKeyboardButton(
+                text=f"График на ПК{suffix}",
+                url=chart['url']
+            )
+            inline_keyboard += [[button_mobile], [button_pc]]
 
         button_change_years = InlineKeyboardButton(
             text="Выбрать другой диапозон лет",
             callback_data="change_years"
         )
+        inline_keyboard.append([button_change_years])
 
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [button_mobile],
-            [button_pc],
-            [button_change_years]
-        ])
+        keyboard = InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
 
         await message.answer("График готов! Нажмите на кнопку ниже:", reply_markup=keyboard)
-        logger.info(f"График {url} показан пользователю {user_id}")
+        logger.info(f"Графики {[chart['url'] for chart in ready]} показаны пользователю {user_id}")
     else:
-        await loading_task  # Дожидаемся окончания анимации
         await message.answer("График пока недоступен. Попробуйте позже.")
-        logger.info(f"График {url} недоступен для пользователя {user_id}")
+        logger.info(f"Графики {[chart['url'] for chart in charts]} недоступны для пользователя {user_id}")
     # Очищаем состояние после успешного выполнения
     await state.clear()
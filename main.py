@@ -3,40 +3,60 @@ import asyncio
 import os
 
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from apscheduler.executors.pool import ThreadPoolExecutor
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
 from dotenv import load_dotenv
 
+from github.check_url import close_session
+from database.db import create_db_pool, init_db, listen_profile_changes, purge_fsm_state, purge_outbox
+from database.fsm_storage import PostgresEventIsolation, PostgresStorage
 from handlers import user_handlers
-from handlers.notifications import load_jobs_from_db
-from handlers.user_handlers import init_db, db_pool
+from handlers.broadcast import broadcast_rates
 from keyboards.menu import set_main_menu
 from logger.logging_settings import logger
 from service.CbRF import currency
+from service.cbr_client import cbr_client
+from service.chart_backend import CHART_BACKEND, publisher
+from service.chart_jobs import prerender_popular_charts
+from service.job_executor import BoundedAsyncIOExecutor
+from service.outbox import RETENTION_DAYS, outbox
+from service.send_limiter import RateLimitMiddleware, send_limiter
+from service.publication_watcher import publication_watcher
+from service.render import shutdown_render_pool
+from web.static_server import start_chart_server
 
 # Загружаем переменные из .env
 load_dotenv()
 
 async def main():
-    # Инициализация базы данных
-    await init_db()
+    # Единый пул подключений к базе данных на все приложение
+    db_pool = await create_db_pool()
+    await init_db(db_pool)
+    # Кэш профилей процесса узнает об изменениях, сделанных другими процессами бота
+    profile_listener = asyncio.create_task(listen_profile_changes())
 
-    # Инициализируем MemoryStorage для хранения данных пользователей
-    storage = MemoryStorage()
+    # Состояния FSM хранятся в общей базе: переживают перезапуск и доступны всем процессам бота
+    storage = PostgresStorage(db_pool)
+    # Апдейты одного пользователя обрабатываются по очереди во всех процессах
+    events_isolation = PostgresEventIsolation(storage)
 
     # Инициализируем бота и диспетчер с хранилищем
+    # Единственный Bot приложения: все отправки идут через его сессию и ограничитель
     bot = Bot(token=os.getenv("BOT_TOKEN"))
-    dp = Dispatcher(storage=storage)
+    bot.session.middleware(RateLimitMiddleware(send_limiter))
+    # db_pool попадает в обработчики, у которых есть такой параметр
+    dp = Dispatcher(storage=storage, events_isolation=events_isolation, db_pool=db_pool)
 
     # Настройки для APScheduler
+    # Пользовательских задач больше нет: все задачи служебные и пересоздаются при запуске
     jobstores = {
-        'default': SQLAlchemyJobStore(url='sqlite:///jobs.sqlite')
+        'default': MemoryJobStore()
     }
 
+    # Задачи — корутины в основном цикле событий, число одновременных ограничено JOB_CONCURRENCY
     executors = {
-        'default': ThreadPoolExecutor(20)
+        'default': BoundedAsyncIOExecutor()
     }
 
     job_defaults = {
@@ -61,13 +81,49 @@ async def main():
     # Передаем планировщик в обработчики
     user_handlers.set_scheduler(scheduler)
 
-    # Загрузка задач из базы данных
-    await load_jobs_from_db(scheduler, db_pool)
+    # Новая публикация курсов рассылается всем подписчикам разом
+    publication_watcher.subscribe(lambda snapshot: broadcast_rates(db_pool, snapshot))
+
+    # Ночью, когда в историю попадает курс нового дня, заранее строим популярные графики
+    scheduler.add_job(
+        prerender_popular_charts,
+        CronTrigger(hour=0, minute=10),
+        args=[db_pool],
+        id='prerender_popular_charts',
+        replace_existing=True
+    )
+
+    # Обработанные сообщения outbox хранятся RETENTION_DAYS дней
+    scheduler.add_job(
+        purge_outbox,
+        CronTrigger(hour=3, minute=0),
+        args=[db_pool, RETENTION_DAYS],
+        id='purge_outbox',
+        replace_existing=True
+    )
+
+    # Брошенные состояния FSM удаляются раз в час
+    scheduler.add_job(
+        purge_fsm_state,
+        CronTrigger(minute=30),
+        args=[db_pool],
+        id='purge_fsm_state',
+        replace_existing=True
+    )
 
     # Настраиваем логирование
     logger.info('Starting bot')
-    currencies = currency()
+    currencies = await currency()
     scheduler.start()
+    # Отправляет рассылки из outbox, в том числе недоставленные до перезапуска
+    outbox.start(bot, db_pool)
+    publication_watcher.start(scheduler)  # Одна задача, сама выбирающая время следующего опроса ЦБ
+
+    # Встроенный сервер графиков вместо GitHub Pages; он же отдает /metrics
+    if CHART_BACKEND == "local" or os.getenv("METRICS_ENABLED"):
+        chart_server = await start_chart_server(serve_static=CHART_BACKEND == "local")
+    else:
+        chart_server = None
 
     try:
         # Пропускаем накопившиеся апдейты и запускаем polling
@@ -80,9 +136,18 @@ async def main():
         logger.error(f'Unexpected error: {e}')
     finally:
         # Закрываем сессию бота
+        await outbox.close()
+        profile_listener.cancel()
         await bot.session.close()
+        await publisher.close()
+        await close_session()
+        if chart_server is not None:
+            await chart_server.cleanup()
+        await cbr_client.close()
+        shutdown_render_pool()
         logger.info('Bot shutdown')
         scheduler.shutdown()  # Выключаем планировщик
+        await db_pool.close()
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
@@ -1,33 +1,32 @@
+import asyncio
 import datetime
 import json
 import os
-import xml.etree.ElementTree as ET
 from pathlib import Path
 
-import pandas as pd
-import plotly.graph_objects as go
-import requests
-
-from github.upload_to_github import upload_to_github
 from logger.logging_settings import logger
+from service.cbr_client import cbr_client
+from service.chart_backend import chart_url, publisher
+from service.chart_cache import ChartCache, chart_key
+from service.downsample import points_per_trace, settings_version as downsample_settings
+from service.render import get_render_pool, render_chart
+from service.series import RateSeries
+from service.xml_stream import parse_dynamic
 
 SAVE_PATH = "static"  # Локальная папка для хранения файлов
+HISTORY_START = datetime.date(2001, 3, 2)  # Первая дата, с которой ЦБ отдает динамику курсов
+
+chart_cache = ChartCache(SAVE_PATH)  # Уже опубликованные графики
 
 
-def currency():
+async def currency():
     """ Сохранение текущих кодов валют с сайта ЦБ РФ в currency_code.json """
     today = datetime.date.today().strftime("%d/%m/%Y")  # Формат: ДД/ММ/ГГГГ
-    url = f"https://www.cbr.ru/scripts/XML_daily.asp?date_req={today}"
-    response = requests.get(url)
-    xml_data = response.content
-    root = ET.fromstring(xml_data)
+    snapshot = await cbr_client.get_daily(today)
     currencies = []
 
-    for valute in root.findall('Valute'):
-        currency_id = valute.get("ID")  # Изменено имя переменной
-        name = valute.find('Name').text
-        charCode = valute.find('CharCode').text
-        currencies.append({"id": currency_id, "name": name, "charCode": charCode})
+    for valute in snapshot.valutes.values():
+        currencies.append({"id": valute.id, "name": valute.name, "charCode": valute.char_code})
 
     try:
         logger.info('Success. Exchange rate codes saved to file: "currency_code.json"')
@@ -39,14 +38,10 @@ def currency():
     return currencies
 
 
-def course_today(selected_data, day):
+async def course_today(selected_data, day):
     """ Получение курса валют из списка выбранных валют и заданного дня """
     try:
-        url = f"https://www.cbr.ru/scripts/XML_daily.asp?date_req={day}"
-        target_ids = []  # Список нужных ID
-        response = requests.get(url)
-        xml_data = response.content
-        root = ET.fromstring(xml_data)
+        snapshot = await cbr_client.get_daily(day)
 
         target_ids = []  # Список нужных ID
 
@@ -65,19 +60,11 @@ def course_today(selected_data, day):
             logger.error(f"Некорректный формат selected_data: {type(selected_data)}")
             return "Ошибка обработки данных."
 
-        date = root.get('Date')
+        date = snapshot.date
         today = day.replace("/", ".")
 
         if today == date:
-            result_string = f"{day}\n"  # Дата на первой строке
-            for valute in root.findall('Valute'):
-                if valute.get('ID') in target_ids:
-                    name = valute.find('Name').text
-                    value = valute.find('Value').text
-                    value = value.replace(',', '.')
-                    nominal = valute.find('Nominal').text
-                    result = float(value) / float(nominal)
-                    result_string += f"{name} = {result}\n"
+            result_string = format_course(snapshot, target_ids, day)
         elif today > date:
             result_string = f"Данные на {day} не опубликованы"
         return result_string
@@ -85,12 +72,41 @@ def course_today(selected_data, day):
         logger.exception(e)
 
 
-def dinamic_course(cod):
-    today = datetime.date.today().strftime("%d/%m/%Y")  # Формат: ДД/ММ/ГГГГ
-    url = f"https://www.cbr.ru/scripts/XML_dynamic.asp?date_req1=02/03/2001&date_req2={today}&VAL_NM_RQ={cod}"
-    response = requests.get(url)
-    xml_data = response.content
-    return xml_data
+def format_course(snapshot, target_ids, day):
+    """ Текст курса выбранных валют из снимка XML_daily: дата и строки 'Название = курс' """
+    result_string = f"{day}\n"  # Дата на первой строке
+    for valute in snapshot.valutes.values():
+        if valute.id in target_ids:
+            result_string += f"{valute.name} = {valute.rate}\n"
+    return result_string
+
+
+def parse_course_text(course_data):
+    """ Обратное к format_course: {название валюты: курс} из текста сообщения """
+    rates = {}
+    for line in (course_data or "").splitlines():
+        name, sep, value = line.rpartition(" = ")
+        if not sep:
+            continue
+        try:
+            rates[name] = float(value.replace(',', '.'))
+        except ValueError:
+            continue
+    return rates
+
+
+async def dinamic_course(cod, date_from=None, date_to=None):
+    """ XML_dynamic по валюте за период (по умолчанию вся история с 02.03.2001 по сегодня) """
+    date_from = date_from or HISTORY_START
+    date_to = date_to or datetime.date.today()
+    return await cbr_client.get_dynamic(cod, date_from.strftime("%d/%m/%Y"), date_to.strftime("%d/%m/%Y"))
+
+
+async def dinamic_records(cod, date_from=None, date_to=None):
+    """ То же, что dinamic_course, но разобранное потоково в список (дата, курс за единицу) """
+    date_from = date_from or HISTORY_START
+    date_to = date_to or datetime.date.today()
+    return await cbr_client.get_dynamic_records(cod, date_from.strftime("%d/%m/%Y"), date_to.strftime("%d/%m/%Y"))
 
 
 def save_file(data_xml, filename):
@@ -110,26 +126,22 @@ def save_file(data_xml, filename):
         print(f'Ошибка при сохранении файла: {e}')
 
 
+def parse_xml_records(xml_data):
+    """Парсит XML_dynamic и возвращает список (дата, значение курса за единицу)."""
+    return parse_dynamic(xml_data)
+
+
 def parse_xml_data(xml_data):
-    """Парсит XML данные и возвращает словарь {год: {дата: значение курса}}."""
-    root = ET.fromstring(xml_data)  # 1
-    data = {}  # 2
-    for record in root.findall('Record'):  # 3
-        date_str = record.get('Date')  # 4
-        year = int(date_str.split('.')[2])  # 5
-        try:
-            value = float(record.find('Value').text.replace(',', '.')) / float(record.find('Nominal').text)  # 6
-        except Exception as e:
-            print(e)
-        data.setdefault(year, {})[date_str] = value  # 7
-    return data  # 8
+    """Парсит XML данные и возвращает ряд курсов RateSeries."""
+    return RateSeries.from_records(parse_xml_records(xml_data))
+
 
 def categorize_currencies(currencies):
     """
     Разбивает валюты на группы на основе их значений.
 
     Args:
-        currencies: Список словарей с данными о валютах.
+        currencies: Список словарей с данными о валютах ('value' — RateSeries).
 
     Returns:
         Список словарей с добавленной информацией о группах.
@@ -140,11 +152,8 @@ def categorize_currencies(currencies):
         name = currency['name']
         value_data = currency['value']
 
-        # Получаем все значения курсов в одном списке
-        all_values = [value for year in value_data.values() for value in year.values()]
-
         # Находим минимальное значение курса
-        min_value = min(all_values) if all_values else 0
+        min_value = value_data.min() or 0
 
         # Определяем группу на основе минимального значения
         if min_value < 10:
@@ -171,17 +180,27 @@ def categorize_currencies(currencies):
 
 
 
-def graf_mobile(currencies, start_year, end_year):
+async def publish_rendered(render_task):
+    """Дожидается отрисовки файла и ставит его в очередь на публикацию."""
+    file_path = await render_task
+    return await publisher.publish(file_path)
+
+
+async def graf_mobile(currencies, start_year, end_year):
     """
     Строит графики курсов валют за указанный период для конкретного пользователя.
 
+    Каждая группа валют рисуется в отдельном процессе, новые файлы
+    публикуются выбранным бэкендом (service/chart_backend.py).
+
     Args:
-        currencies: Список валют с данными о курсах.
+        currencies: Список валют с данными о курсах (RateSeries).
         start_year: Год начала периода.
         end_year: Год конца периода.
 
     Returns:
-        str: Ссылка на график.
+        list: По графику на группу: [{'names': 'EUR, USD', 'url': ссылка,
+              'published': опубликован ли файл, 'live': доступна ли уже ссылка}].
     """
     grouped_data = {}
 
@@ -192,60 +211,57 @@ def graf_mobile(currencies, start_year, end_year):
         group = currency['group']
 
         for year in range(start_year, end_year + 1):
-            year_data = value_data.get(year, {})
-            if year_data:
+            year_data = value_data.years(year, year)
+            if len(year_data):
                 if group not in grouped_data:
                     grouped_data[group] = {'names': set(), 'data': []}
                 grouped_data[group]['names'].add(name)
                 grouped_data[group]['data'].append({'name': name, 'year': year, 'data': year_data})
 
+    # Генерация пути
+    os.makedirs(SAVE_PATH, exist_ok=True)
+    max_points = points_per_trace(start_year, end_year)
+    loop = asyncio.get_running_loop()
+
+    charts = []
+    rendering = []  # (график, ключ кэша, имя файла, задача отрисовки)
+
     # Генерация графиков
-    for group, data_group in grouped_data.items():
-        fig = go.Figure()
-        names_str = ', '.join(data_group['names'])
-
-        for data_entry in data_group['data']:
-            name = data_entry['name']
-            year = data_entry['year']
-            year_data = data_entry['data']
-
-            temp_df = pd.DataFrame(year_data.items(), columns=['Дата', 'Курс'])
-            temp_df['Дата'] = pd.to_datetime(temp_df['Дата'], format='%d.%m.%Y')
-
-            fig.add_trace(go.Scatter(
-                x=temp_df['Дата'],
-                y=temp_df['Курс'],
-                mode='lines',
-                name=f'{name} - {year}',
-                hoverinfo='y+text',
-                text=f'{name}'
-            ))
-
-        fig.update_layout(
-            title=f'{names_str}: Курсы валют с {start_year} по {end_year} год',
-            xaxis_title='Дата',
-            yaxis_title='Курс',
-            xaxis=dict(
-                tickformat='%d.%m.%y',
-                tickangle=45
-            ),
-            hovermode='x',
-            showlegend=False
-        )
-
-        # Генерация пути
-        # user_folder = os.path.join(SAVE_PATH, str(user_id))
-        user_folder = os.path.join(SAVE_PATH)
-        os.makedirs(user_folder, exist_ok=True)
-
-        names = names_str.replace(", ", "_")
-        file_name = f"{names}_{start_year}_{end_year}.html"
-
-        file_path = os.path.join(user_folder, file_name)
-
-        fig.write_html(file_path)  # Сохраняем HTML
+    for group, data_group in sorted(grouped_data.items()):
+        names_sorted = sorted(data_group['names'])
+        names_str = ', '.join(names_sorted)
+
+        # Тот же набор валют и период на тех же данных уже опубликован
+        data_version = max(data_entry['data'].last_date for data_entry in data_group['data'])
+        key = chart_key(names_sorted, start_year, end_year, f"{data_version}|{downsample_settings()}")
+        file_url = chart_cache.get(key)
+        if file_url:
+            logger.info(f"График {names_str} {start_year}-{end_year} взят из кэша")
+            # Ссылка публиковалась раньше; на GitHub Pages ее доступность еще проверяется
+            charts.append({'names': names_str, 'url': file_url, 'published': True, 'live': publisher.live})
+            continue
+
+        names = "_".join(names_sorted)
+        file_name = f"{names}_{start_year}_{end_year}_{key}.html"
+        file_path = os.path.abspath(os.path.join(SAVE_PATH, file_name))
+
+        # Длинные периоды прореживаются при отрисовке: линии сохраняют форму и экстремумы
+        entries = [(data_entry['name'], data_entry['year'], data_entry['data'].dates, data_entry['data'].values)
+                   for data_entry in data_group['data']]
+        task = loop.run_in_executor(get_render_pool(), render_chart,
+                                    names_str, entries, start_year, end_year, file_path, max_points)
 
         # Генерируем ссылку
-        file_url = f"{os.getenv("GITHUB_PAGES")}static/{file_name}"
-        upload_to_github()
-        return file_url
+        chart = {'names': names_str, 'url': chart_url(file_name), 'published': False, 'live': False}
+        charts.append(chart)
+        rendering.append((chart, key, file_name, publish_rendered(task)))
+
+    # Файлы публикуются вместе с графиками других пользователей, готовыми в то же время
+    results = await asyncio.gather(*(publishing for *_, publishing in rendering))
+    for (chart, key, file_name, _), published in zip(rendering, results):
+        chart['published'] = published
+        chart['live'] = published and publisher.live
+        if published:
+            chart_cache.put(key, file_name, chart['url'])
+
+    return charts
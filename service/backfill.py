@@ -0,0 +1,162 @@
+"""
+Первичное заполнение rate_history по всем валютам ЦБ.
+
+Период каждой валюты делится на годовые куски, которые загружаются
+параллельно ограниченным числом воркеров и сохраняются пачками через COPY.
+Готовые куски записываются в save_files/backfill_checkpoint.json,
+поэтому прерванный запуск продолжается с того же места.
+
+Запуск: python -m service.backfill [--workers 8] [--from-year 2001] [--currencies R01235,R01239]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import time
+from pathlib import Path
+
+from tenacity import retry, wait_exponential, stop_after_attempt
+
+from database.db import create_db_pool, create_history_table, save_history_bulk
+from handlers.selected_currency import load_currency_data
+from logger.logging_settings import logger
+from service.CbRF import HISTORY_START, dinamic_records
+from service.cbr_client import cbr_client
+
+project_root = Path(__file__).resolve().parent.parent
+CURRENCY_FILE = project_root / 'save_files/currency_code.json'
+CHECKPOINT_FILE = project_root / 'save_files/backfill_checkpoint.json'
+
+WORKERS = int(os.getenv("BACKFILL_WORKERS", 8))
+BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", 20000))  # Записей в одном COPY
+
+
+def load_checkpoint(path=CHECKPOINT_FILE):
+    """Возвращает множество готовых кусков вида 'R01235:2005'."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return set(json.load(f).get("done", []))
+    except FileNotFoundError:
+        return set()
+    except json.JSONDecodeError:
+        logger.error(f"Файл {path} содержит некорректный JSON, начинаем заново.")
+        return set()
+
+
+def save_checkpoint(done, path=CHECKPOINT_FILE):
+    """Атомарно сохраняет список готовых кусков."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"done": sorted(done)}, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+def year_chunks(currency_ids, from_year, today):
+    """Разбивает период каждой валюты на годовые куски (currency_id, начало, конец)."""
+    for currency_id in currency_ids:
+        for year in range(from_year, today.year + 1):
+            start = max(datetime.date(year, 1, 1), HISTORY_START)
+            end = min(datetime.date(year, 12, 31), today)
+            if start <= end:
+                yield currency_id, start, end
+
+
+def chunk_key(currency_id, start):
+    return f"{currency_id}:{start.year}"
+
+
+@retry(wait=wait_exponential(multiplier=1, min=2, max=30), stop=stop_after_attempt(5), reraise=True)
+async def fetch_chunk(currency_id, start, end):
+    return await dinamic_records(currency_id, start, end)
+
+
+async def backfill(pool, currency_ids, from_year=HISTORY_START.year, workers=WORKERS,
+                   batch_size=BATCH_SIZE, checkpoint_path=CHECKPOINT_FILE):
+    """
+    Загружает историю валют годовыми кусками и сохраняет ее пачками.
+
+    Returns:
+        int: Количество сохраненных записей.
+    """
+    today = datetime.date.today()
+    done = load_checkpoint(checkpoint_path)
+    queue = asyncio.Queue()
+    for chunk in year_chunks(currency_ids, from_year, today):
+        # Текущий год всегда догружаем: он еще не закончился
+        if chunk_key(chunk[0], chunk[1]) not in done or chunk[1].year == today.year:
+            queue.put_nowait(chunk)
+
+    total_chunks = queue.qsize()
+    logger.info(f"Backfill: {total_chunks} chunks for {len(currency_ids)} currencies, {workers} workers")
+
+    buffer = []  # Записи, ожидающие COPY
+    buffered_keys = []  # Куски, чьи записи лежат в buffer
+    saved = 0
+    failed = 0
+    flush_lock = asyncio.Lock()
+    started = time.monotonic()
+
+    async def flush():
+        nonlocal buffer, buffered_keys, saved
+        async with flush_lock:
+            if not buffered_keys:
+                return
+            rows, keys = buffer, buffered_keys
+            buffer, buffered_keys = [], []
+            if rows:
+                saved += await save_history_bulk(pool, rows)
+            done.update(keys)
+            save_checkpoint(done, checkpoint_path)
+            elapsed = time.monotonic() - started
+            logger.info(f"Backfill: {len(done)} chunks done, {saved} rows, {saved / elapsed:.0f} rows/sec")
+
+    async def worker():
+        nonlocal failed
+        while True:
+            try:
+                currency_id, start, end = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                records = await fetch_chunk(currency_id, start, end)
+            except Exception as e:
+                failed += 1
+                logger.error(f"Backfill: chunk {chunk_key(currency_id, start)} failed: {e}")
+                continue
+            buffer.extend((currency_id, date, value) for date, value in records)
+            buffered_keys.append(chunk_key(currency_id, start))
+            if len(buffer) >= batch_size:
+                await flush()
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    await flush()
+
+    elapsed = time.monotonic() - started
+    rate = saved / elapsed if elapsed else 0
+    logger.info(f"Backfill finished: {saved} rows in {elapsed:.1f} s ({rate:.0f} rows/sec), "
+                f"{failed} of {total_chunks} chunks failed")
+    return saved
+
+
+async def main(args):
+    if args.currencies:
+        currency_ids = args.currencies.split(",")
+    else:
+        currency_ids = [item["id"] for item in load_currency_data(CURRENCY_FILE)]
+
+    pool = await create_db_pool()
+    try:
+        await create_history_table(pool)
+        await backfill(pool, currency_ids, from_year=args.from_year, workers=args.workers)
+    finally:
+        await cbr_client.close()
+        await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заполнение истории курсов ЦБ РФ")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Количество параллельных загрузок")
+    parser.add_argument("--from-year", type=int, default=HISTORY_START.year, help="Первый загружаемый год")
+    parser.add_argument("--currencies", help="ID валют через запятую (по умолчанию все из currency_code.json)")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,202 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+import aiohttp
+
+from logger.logging_settings import logger
+from service.xml_stream import DailyStream, DynamicStream, parse_daily
+
+CBR_DAILY_URL = "https://www.cbr.ru/scripts/XML_daily.asp"
+CBR_DYNAMIC_URL = "https://www.cbr.ru/scripts/XML_dynamic.asp"
+
+# Опубликованный курс на дату не меняется, поэтому держим его долго.
+# Если на запрошенную дату данных еще нет, перепроверяем через короткий интервал.
+PUBLISHED_TTL = int(os.getenv("CBR_CACHE_TTL", 6 * 3600))
+PENDING_TTL = int(os.getenv("CBR_PENDING_TTL", 60))
+MAX_ENTRIES = int(os.getenv("CBR_CACHE_SIZE", 32))
+REQUEST_TIMEOUT = float(os.getenv("CBR_TIMEOUT", 10))
+CHUNK_SIZE = 64 * 1024  # Размер порции чтения ответа для потокового разбора
+DYNAMIC_TIMEOUT = float(os.getenv("CBR_DYNAMIC_TIMEOUT", 60))  # История за годы отдается дольше
+
+
+class Valute:
+    """Курс одной валюты из XML_daily."""
+    __slots__ = ("id", "name", "char_code", "value", "nominal")
+
+    def __init__(self, id, name, char_code, value, nominal):
+        self.id = id
+        self.name = name
+        self.char_code = char_code
+        self.value = value
+        self.nominal = nominal
+
+    @property
+    def rate(self):
+        """Курс за одну единицу валюты."""
+        return self.value / self.nominal
+
+
+class DailySnapshot:
+    """Разобранный XML_daily: дата публикации и курсы по ID валюты."""
+    __slots__ = ("date", "valutes")
+
+    def __init__(self, date, valutes):
+        self.date = date  # Формат ДД.ММ.ГГГГ, как в атрибуте Date
+        self.valutes = valutes  # {id: Valute}, в порядке документа
+
+    @classmethod
+    def from_xml(cls, xml_data):
+        date, records = parse_daily(xml_data)
+        return cls.from_records(date, records)
+
+    @classmethod
+    def from_records(cls, date, records):
+        valutes = {}
+        for valute_id, name, char_code, value, nominal in records:
+            valutes[valute_id] = Valute(valute_id, name, char_code, value, nominal)
+        return cls(date, valutes)
+
+
+class CbrClient:
+    """
+    Асинхронный клиент ЦБ РФ с общей HTTP-сессией.
+
+    Хранит по одному разобранному снимку XML_daily на дату запроса (LRU + TTL)
+    и объединяет одновременные запросы одной даты в одну загрузку.
+    """
+
+    def __init__(self, published_ttl=PUBLISHED_TTL, pending_ttl=PENDING_TTL,
+                 max_entries=MAX_ENTRIES, timeout=REQUEST_TIMEOUT):
+        self.published_ttl = published_ttl
+        self.pending_ttl = pending_ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._cache = OrderedDict()  # {day: (expires_at, DailySnapshot)}
+        self._inflight = {}  # {day: asyncio.Task}
+        self._session = None
+        self._loop = None
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Возвращает общую сессию, создавая ее при первом обращении."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300),
+            )
+            self._loop = asyncio.get_running_loop()
+        return self._session
+
+    def _foreign_loop(self):
+        """Цикл-владелец сессии, если вызов пришел из другого цикла событий."""
+        if self._loop is None or self._loop.is_closed() or not self._loop.is_running():
+            return None
+        if self._loop is asyncio.get_running_loop():
+            return None
+        return self._loop
+
+    def _cached(self, day):
+        entry = self._cache.get(day)
+        if entry is None:
+            return None
+        expires_at, snapshot = entry
+        if expires_at < time.monotonic():
+            del self._cache[day]
+            return None
+        self._cache.move_to_end(day)
+        return snapshot
+
+    def _store(self, day, snapshot):
+        published = snapshot.date == day.replace("/", ".")
+        ttl = self.published_ttl if published else self.pending_ttl
+        self._cache[day] = (time.monotonic() + ttl, snapshot)
+        self._cache.move_to_end(day)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def get_daily(self, day) -> DailySnapshot:
+        """Возвращает снимок XML_daily на дату day (ДД/ММ/ГГГГ)."""
+        snapshot = self._cached(day)
+        if snapshot is not None:
+            return snapshot
+
+        # Сессия и задачи загрузки привязаны к циклу, в котором создана сессия
+        owner = self._foreign_loop()
+        if owner is not None:
+            future = asyncio.run_coroutine_threadsafe(self.get_daily(day), owner)
+            return await asyncio.wrap_future(future)
+
+        task = self._inflight.get(day)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_daily(day))
+            self._inflight[day] = task
+            task.add_done_callback(lambda _: self._inflight.pop(day, None))
+        return await asyncio.shield(task)
+
+    async def _fetch_daily(self, day):
+        session = await self.get_session()
+        stream = DailyStream()
+        records = []
+        async with session.get(CBR_DAILY_URL, params={"date_req": day}) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                records += stream.feed(chunk)
+        records += stream.close()
+        snapshot = DailySnapshot.from_records(stream.root_attrib.get("Date"), records)
+        self._store(day, snapshot)
+        logger.info(f"CBR daily rates for {day} loaded (published {snapshot.date})")
+        return snapshot
+
+    async def get_dynamic(self, cod, date_from, date_to) -> bytes:
+        """Возвращает XML_dynamic по валюте cod за период (даты в формате ДД/ММ/ГГГГ)."""
+        owner = self._foreign_loop()
+        if owner is not None:
+            future = asyncio.run_coroutine_threadsafe(self.get_dynamic(cod, date_from, date_to), owner)
+            return await asyncio.wrap_future(future)
+
+        session = await self.get_session()
+        params = {"date_req1": date_from, "date_req2": date_to, "VAL_NM_RQ": cod}
+        async with session.get(CBR_DYNAMIC_URL, params=params,
+                               timeout=aiohttp.ClientTimeout(total=DYNAMIC_TIMEOUT)) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def get_dynamic_records(self, cod, date_from, date_to):
+        """
+        Загружает XML_dynamic по валюте cod за период и разбирает его потоково, по мере чтения ответа.
+
+        Returns:
+            list: Пары (дата, курс за единицу).
+        """
+        owner = self._foreign_loop()
+        if owner is not None:
+            future = asyncio.run_coroutine_threadsafe(self.get_dynamic_records(cod, date_from, date_to), owner)
+            return await asyncio.wrap_future(future)
+
+        session = await self.get_session()
+        params = {"date_req1": date_from, "date_req2": date_to, "VAL_NM_RQ": cod}
+        stream = DynamicStream()
+        records = []
+        async with session.get(CBR_DYNAMIC_URL, params=params,
+                               timeout=aiohttp.ClientTimeout(total=DYNAMIC_TIMEOUT)) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                records += stream.feed(chunk)
+        return records + stream.close()
+
+    def invalidate(self, day=None):
+        """Сбрасывает кэш целиком или для одной даты."""
+        if day is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(day, None)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+# Общий клиент приложения
+cbr_client = CbrClient()
@@ -0,0 +1,28 @@
+import os
+
+from github.publisher import publisher as github_publisher
+from web.static_server import LocalPublisher
+
+# github — публикация на GitHub Pages (по умолчанию), local — встроенный сервер графиков
+CHART_BACKEND = os.getenv("CHART_BACKEND", "github")
+if CHART_BACKEND not in ("github", "local"):
+    raise ValueError(f"Неизвестный CHART_BACKEND: {CHART_BACKEND}")
+
+# html — отдельный HTML с plotly.js на каждый график (service/CbRF.py),
+# shards — общая страница просмотра и годовые файлы данных (service/shards.py)
+CHART_FORMAT = os.getenv("CHART_FORMAT", "html")
+if CHART_FORMAT not in ("html", "shards"):
+    raise ValueError(f"Неизвестный CHART_FORMAT: {CHART_FORMAT}")
+
+# Публикатор выбранного бэкенда: publish(file_path) -> bool, close()
+publisher = LocalPublisher() if CHART_BACKEND == "local" else github_publisher
+
+
+def chart_url(file_name):
+    """Ссылка на опубликованный график."""
+    if CHART_BACKEND == "local":
+        # Внешний адрес бота (для WebApp в Telegram нужен https за обратным прокси)
+        base_url = os.getenv("CHART_BASE_URL", "")
+    else:
+        base_url = os.getenv("GITHUB_PAGES", "")
+    return f"{base_url}static/{file_name}"
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+from logger.logging_settings import logger
+
+project_root = Path(__file__).resolve().parent.parent
+INDEX_FILE = project_root / 'save_files/chart_cache.json'
+
+# Сколько байт графиков держать в static/, прежде чем удалять давно не запрошенные
+DISK_BUDGET = int(os.getenv("CHART_CACHE_BYTES", 200 * 1024 * 1024))
+
+
+def chart_key(names, start_year, end_year, data_version):
+    """
+    Ключ графика: набор валют (без учета порядка), период и дата последнего курса в данных.
+    Новые данные дают новый ключ, поэтому опубликованный файл никогда не перезаписывается.
+    """
+    raw = f"{','.join(sorted(names))}|{start_year}|{end_year}|{data_version}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+
+class ChartCache:
+    """
+    Кэш отрисованных графиков: ключ -> опубликованный файл и его ссылка.
+
+    Порядок записей — порядок последнего использования (LRU). Когда файлы
+    занимают больше disk_budget, самые старые удаляются из static/; удаление
+    уходит на GitHub со следующей публикацией.
+    """
+
+    def __init__(self, directory, index_path=INDEX_FILE, disk_budget=DISK_BUDGET):
+        self.directory = Path(directory)
+        self.index_path = Path(index_path)
+        self.disk_budget = disk_budget
+        self._entries = OrderedDict()  # {key: {"file_name", "url", "size"}}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self._entries = OrderedDict(json.load(f))
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError:
+            logger.error(f"Файл {self.index_path} содержит некорректный JSON, кэш графиков сброшен.")
+
+    def _save(self):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.index_path)
+
+    def path(self, file_name):
+        return self.directory / file_name
+
+    def get(self, key):
+        """Возвращает ссылку на опубликованный график или None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if not self.path(entry["file_name"]).is_file():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry["url"]
+
+    def put(self, key, file_name, url):
+        """Запоминает отрисованный график и освобождает место под бюджет."""
+        size = self.path(file_name).stat().st_size
+        self._entries[key] = {"file_name": file_name, "url": url, "size": size}
+        self._entries.move_to_end(key)
+        self.evict()
+        self._save()
+
+    def evict(self):
+        """Удаляет давно не использованные графики, пока кэш не уложится в бюджет."""
+        total = sum(entry["size"] for entry in self._entries.values())
+        while total > self.disk_budget and len(self._entries) > 1:
+            key, entry = self._entries.popitem(last=False)
+            total -= entry["size"]
+            try:
+                path = self.path(entry["file_name"])
+                path.unlink(missing_ok=True)
+                # Сжатые копии встроенного сервера графиков (web/static_server.py)
+                for suffix in (".gz", ".br"):
+                    path.with_name(path.name + suffix).unlink(missing_ok=True)
+                logger.info(f"Удален файл: {entry['file_name']}")
+            except OSError as e:
+                logger.error(f"Не удалось удалить {entry['file_name']}: {e}")
@@ -0,0 +1,178 @@
+import asyncio
+import datetime
+import os
+from collections import OrderedDict
+
+from database.db import get_top_chart_requests
+from logger.logging_settings import logger
+from service.CbRF import categorize_currencies, graf_mobile
+from service.chart_backend import CHART_FORMAT
+from service.history import load_history, sync_history
+from service.metrics import Counter
+from service.render import RENDER_WORKERS
+from service.shards import graf_shards
+
+# Сколько заявок на графики строится одновременно (отрисовка — в пуле процессов service/render.py)
+JOB_WORKERS = int(os.getenv("CHART_JOB_WORKERS", RENDER_WORKERS))
+# Сколько заявок может ждать в очереди, дальше новые отклоняются
+QUEUE_LIMIT = int(os.getenv("CHART_QUEUE_LIMIT", 100))
+# Ночная предотрисовка: сколько самых частых графиков и за сколько последних дней запросов
+PRERENDER_TOP_N = int(os.getenv("CHART_PRERENDER_TOP_N", 20))
+PRERENDER_DAYS = int(os.getenv("CHART_PRERENDER_DAYS", 30))
+
+chart_jobs_total = Counter("chart_jobs_total", "Заявки на графики: new — новая, merged — присоединена "
+                                               "к такой же заявке, rejected — очередь переполнена")
+
+
+class ChartQueueFull(Exception):
+    """Очередь графиков переполнена."""
+
+
+class _Job:
+    __slots__ = ("key", "factory", "future", "listeners")
+
+    def __init__(self, key, factory):
+        self.key = key
+        self.factory = factory
+        self.future = asyncio.get_running_loop().create_future()
+        self.listeners = []
+
+
+class ChartJobQueue:
+    """
+    Очередь заявок на графики.
+
+    Одновременно выполняется не больше workers заявок, остальные ждут в порядке
+    поступления, но не больше limit. Заявка с тем же ключом (те же валюты и
+    период), что уже ждет или строится, не создает новую работу: вызывающий
+    получает результат первой. Каждый ожидающий узнает свое место в очереди
+    через on_position(n), 0 — заявка строится.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, limit=QUEUE_LIMIT):
+        self.workers = workers
+        self.limit = limit
+        self._waiting = OrderedDict()  # {ключ: заявка} в порядке очереди
+        self._running = {}
+
+    def position(self, key):
+        """Место заявки в очереди: 0 — строится, None — заявки нет."""
+        if key in self._running:
+            return 0
+        for position, waiting_key in enumerate(self._waiting, 1):
+            if waiting_key == key:
+                return position
+        return None
+
+    async def submit(self, key, factory, on_position=None):
+        """
+        Ставит заявку в очередь и ждет ее результата.
+
+        Args:
+            key: Ключ заявки; одинаковые заявки объединяются.
+            factory: Функция без аргументов, возвращающая корутину построения.
+            on_position: Вызывается с местом в очереди при каждом его изменении.
+        """
+        job = self._running.get(key) or self._waiting.get(key)
+        if job is not None:
+            chart_jobs_total.inc(kind="merged")
+        else:
+            if len(self._waiting) >= self.limit:
+                chart_jobs_total.inc(kind="rejected")
+                raise ChartQueueFull()
+            chart_jobs_total.inc(kind="new")
+            job = _Job(key, factory)
+            self._waiting[key] = job
+            self._dispatch()
+
+        if on_position is not None:
+            job.listeners.append(on_position)
+            on_position(self.position(key))
+        # shield: отмена одного ожидающего не отменяет заявку для остальных
+        return await asyncio.shield(job.future)
+
+    def _dispatch(self):
+        while self._waiting and len(self._running) < self.workers:
+            key, job = self._waiting.popitem(last=False)
+            self._running[key] = job
+            asyncio.create_task(self._execute(job))
+        self._notify()
+
+    def _notify(self):
+        for job in self._running.values():
+            for listener in job.listeners:
+                listener(0)
+        for position, job in enumerate(self._waiting.values(), 1):
+            for listener in job.listeners:
+                listener(position)
+
+    async def _execute(self, job):
+        try:
+            job.future.set_result(await job.factory())
+        except Exception as e:
+            logger.error(f"Ошибка построения графиков {job.key}: {e}")
+            job.future.set_exception(e)
+            job.future.exception()  # Ошибку уже записали в лог, ожидающие получат ее сами
+        finally:
+            del self._running[job.key]
+            self._dispatch()
+
+
+def chart_job_key(selected_data, start_year, end_year):
+    """Одинаковый набор валют и период дают одну заявку, чьи бы они ни были."""
+    return tuple(sorted(sd['id'] for sd in selected_data)), start_year, end_year
+
+
+async def build_user_charts(pool, selected_data, start_year, end_year):
+    """Загружает историю выбранных валют и строит по ним графики выбранного формата."""
+    selected_data_list = []
+    for sd in selected_data:
+        result_data = await load_history(pool, sd['id'], start_year, end_year)
+        selected_data_list.append({"name": sd['charCode'], "value": result_data})
+
+    group_for_graf = categorize_currencies(selected_data_list)
+    build_charts = graf_shards if CHART_FORMAT == "shards" else graf_mobile
+    return await build_charts(group_for_graf, start_year, end_year)
+
+
+# Общая очередь графиков приложения
+chart_queue = ChartJobQueue()
+
+
+async def prerender_popular_charts(pool, top_n=PRERENDER_TOP_N, days=PRERENDER_DAYS):
+    """
+    Заранее строит и публикует самые запрашиваемые графики на свежих данных,
+    чтобы днем такие запросы брались из кэша графиков.
+
+    Заявки идут через общую очередь по одной: пользователи, запросившие тот же
+    график в это время, получают его же, а остальные не ждут всю пачку.
+    """
+    current_year = datetime.date.today().year
+    top = await get_top_chart_requests(pool, top_n, days)
+
+    # Свежий день догружается в обход часового интервала sync_history: валюту могли
+    # запрашивать незадолго до полуночи, и график построился бы без нового дня
+    for currency_id in {sd['id'] for request in top for sd in request['currencies']}:
+        try:
+            await sync_history(pool, currency_id, force=True)
+        except Exception as e:
+            logger.error(f"History sync for {currency_id} failed: {e}")
+
+    built = 0
+    for request in top:
+        selected_data = request['currencies']
+        start_year, end_year = request['start_year'], min(request['end_year'], current_year)
+        if start_year > end_year:
+            continue
+        try:
+            await chart_queue.submit(
+                chart_job_key(selected_data, start_year, end_year),
+                lambda: build_user_charts(pool, selected_data, start_year, end_year)
+            )
+            built += 1
+        except ChartQueueFull:
+            logger.info("Предотрисовка прервана: очередь графиков занята пользователями")
+            break
+        except Exception as e:
+            logger.error(f"Ошибка предотрисовки {request}: {e}")
+    logger.info(f"Предотрисовано графиков: {built} из {len(top)}")
@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+
+from service.series import RateSeries
+
+# lttb (по умолчанию), minmax или off
+DOWNSAMPLE_MODE = os.getenv("CHART_DOWNSAMPLE", "lttb")
+# Сколько точек на одну валюту показывать на графике за весь период
+MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", 1000))
+# Меньше точек на линию (год) не оставляем, даже на очень длинном периоде
+MIN_POINTS_PER_TRACE = 20
+
+
+def points_per_trace(start_year, end_year, max_points=MAX_POINTS):
+    """Предел точек на линию графика: бюджет валюты делится на количество лет."""
+    return max(MIN_POINTS_PER_TRACE, max_points // (end_year - start_year + 1))
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: индексы threshold точек, сохраняющих форму ряда.
+
+    Первая и последняя точки остаются; из каждой корзины берется точка, образующая
+    наибольший треугольник с предыдущей выбранной точкой и средним следующей корзины.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype=np.intp)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        indices[i + 1] = a
+    return indices
+
+
+def minmax_indices(y, threshold):
+    """Минимум и максимум каждой из threshold/2 корзин: экстремумы сохраняются точно."""
+    n = len(y)
+    if threshold >= n or threshold < 2:
+        return np.arange(n)
+
+    edges = np.linspace(0, n, threshold // 2 + 1).astype(np.intp)
+    indices = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        if start == end:
+            continue
+        bucket = y[start:end]
+        indices += [start + int(bucket.argmin()), start + int(bucket.argmax())]
+    return np.unique(indices)
+
+
+def downsample(series, max_points, mode=None):
+    """Прореживает ряд до max_points точек выбранным методом."""
+    mode = mode or DOWNSAMPLE_MODE
+    if mode == "off" or len(series) <= max_points:
+        return series
+    if mode == "minmax":
+        indices = minmax_indices(series.values, max_points)
+    elif mode == "lttb":
+        x = series.dates.astype(np.int64).astype(np.float64)
+        indices = lttb_indices(x, series.values, max_points)
+    else:
+        raise ValueError(f"Неизвестный метод прореживания: {mode}")
+    return RateSeries(series.dates[indices], series.values[indices])
+
+
+def settings_version():
+    """Настройки прореживания, влияющие на содержимое графика (часть ключа кэша)."""
+    return f"{DOWNSAMPLE_MODE}:{MAX_POINTS}"
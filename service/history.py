@@ -0,0 +1,56 @@
+import asyncio
+import datetime
+import os
+import time
+
+from database.db import get_last_history_date, save_history, get_history
+from logger.logging_settings import logger
+from service.CbRF import HISTORY_START, dinamic_records
+
+# Как часто (в секундах) проверять у ЦБ новые дни для одной валюты
+SYNC_INTERVAL = int(os.getenv("HISTORY_SYNC_INTERVAL", 3600))
+
+_synced_at = {}  # {currency_id: time.monotonic() последней синхронизации}
+_locks = {}  # {currency_id: asyncio.Lock}
+
+
+async def sync_history(pool, currency_id, today=None, force=False):
+    """
+    Догружает в rate_history недостающие дни истории валюты.
+
+    При первом обращении выкачивается вся история с 2001 года,
+    дальше запрашиваются только дни после последней сохраненной даты.
+    Чаще раза в SYNC_INTERVAL ЦБ не опрашивается, если не передан force.
+
+    Returns:
+        int: Количество новых записей.
+    """
+    lock = _locks.setdefault(currency_id, asyncio.Lock())
+    async with lock:
+        synced_at = _synced_at.get(currency_id)
+        if not force and synced_at is not None and time.monotonic() - synced_at < SYNC_INTERVAL:
+            return 0
+
+        today = today or datetime.date.today()
+        last_date = await get_last_history_date(pool, currency_id)
+        date_from = last_date + datetime.timedelta(days=1) if last_date else HISTORY_START
+
+        records = []
+        if date_from <= today:
+            records = await dinamic_records(currency_id, date_from, today)
+            if records:
+                await save_history(pool, currency_id, records)
+                logger.info(f"History {currency_id}: {len(records)} new records since {date_from}")
+
+        _synced_at[currency_id] = time.monotonic()
+        return len(records)
+
+
+async def load_history(pool, currency_id, start_year, end_year):
+    """Возвращает историю валюты за годы start_year..end_year, предварительно догрузив новые дни."""
+    try:
+        await sync_history(pool, currency_id)
+    except Exception as e:
+        # Без связи с ЦБ строим график по уже сохраненным данным
+        logger.error(f"History sync for {currency_id} failed: {e}")
+    return await get_history(pool, currency_id, start_year, end_year)
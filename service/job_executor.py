@@ -0,0 +1,49 @@
+import asyncio
+import os
+import sys
+
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from apscheduler.executors.base import run_coroutine_job
+from apscheduler.util import iscoroutinefunction_partial
+
+# Сколько задач планировщика может выполняться одновременно
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", 100))
+
+
+class BoundedAsyncIOExecutor(AsyncIOExecutor):
+    """
+    Исполнитель APScheduler, запускающий корутины задач в основном цикле событий.
+
+    В отличие от AsyncIOExecutor число одновременно работающих задач ограничено
+    семафором: сработавшие сверх лимита задачи ждут своей очереди, а не потоков.
+    Обычные функции по-прежнему уходят в пул потоков цикла.
+    """
+
+    def __init__(self, limit=JOB_CONCURRENCY):
+        super().__init__()
+        self.limit = limit
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        self._semaphore = asyncio.Semaphore(self.limit)
+
+    async def _run_bounded(self, job, run_times):
+        async with self._semaphore:
+            return await run_coroutine_job(job, job._jobstore_alias, run_times, self._logger.name)
+
+    def _do_submit_job(self, job, run_times):
+        if not iscoroutinefunction_partial(job.func):
+            return super()._do_submit_job(job, run_times)
+
+        def callback(f):
+            self._pending_futures.discard(f)
+            try:
+                events = f.result()
+            except BaseException:
+                self._run_job_error(job.id, *sys.exc_info()[1:])
+            else:
+                self._run_job_success(job.id, events)
+
+        f = self._eventloop.create_task(self._run_bounded(job, run_times))
+        f.add_done_callback(callback)
+        self._pending_futures.add(f)
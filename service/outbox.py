@@ -0,0 +1,124 @@
+import asyncio
+import datetime
+import os
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from database.db import claim_outbox, complete_outbox, get_outbox_depth
+from logger.logging_settings import logger
+from service.metrics import Counter, Gauge, Histogram
+from service.send_limiter import PRIORITY_BROADCAST, send_priority
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", 4))
+BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 50))
+LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE", 120))  # Не отправленное за это время сообщение берется снова
+POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 5))
+RETRY_DELAY = float(os.getenv("OUTBOX_RETRY_DELAY", 30))
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 5))
+RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", 7))
+DEPTH_INTERVAL = 15
+
+outbox_messages_total = Counter("outbox_messages_total", "Обработанные сообщения outbox по итогу (sent, retry, failed)")
+outbox_depth = Gauge("outbox_depth", "Сообщения outbox, ожидающие отправки")
+outbox_lag_seconds = Histogram(
+    "outbox_delivery_lag_seconds", "Время от постановки сообщения в outbox до доставки",
+    buckets=(1, 5, 15, 60, 300, 900, 3600),
+)
+
+
+class OutboxWorker:
+    """
+    Отправляет сообщения из таблицы outbox.
+
+    Несколько обработчиков забирают готовые сообщения пачками (FOR UPDATE SKIP
+    LOCKED с арендой), отправляют их и записывают итоги пачки одним запросом.
+    Доставка — как минимум один раз: после падения процесса арендованные, но
+    не отмеченные сообщения отправятся повторно.
+    """
+
+    def __init__(self, workers=OUTBOX_WORKERS, batch_size=BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self._bot = None
+        self._pool = None
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self._closed = False
+
+    def start(self, bot, pool):
+        self._bot = bot
+        self._pool = pool
+        self._closed = False
+        self._tasks = [asyncio.ensure_future(self._run()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._report_depth()))
+
+    def wake(self):
+        """Будит обработчики сразу после постановки новых сообщений."""
+        self._wakeup.set()
+
+    async def _run(self):
+        send_priority.set(PRIORITY_BROADCAST)
+        # Флаг, а не только отмена: wait_for может поглотить отмену, если пробуждение пришло одновременно с ней
+        while not self._closed:
+            try:
+                batch = await claim_outbox(self._pool, self.batch_size, LEASE_SECONDS)
+            except Exception as e:
+                logger.error(f"Outbox: failed to claim messages: {e}")
+                batch = []
+            if not batch:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            await self._deliver(batch)
+
+    async def _deliver(self, batch):
+        outcomes = await asyncio.gather(*(self._send(row) for row in batch))
+        sent, retry, failed = [], [], []
+        for row, error in zip(batch, outcomes):
+            if error is None:
+                sent.append(row["id"])
+            elif isinstance(error, (TelegramForbiddenError, TelegramBadRequest)) or row["attempts"] >= MAX_ATTEMPTS:
+                failed.append((row["id"], str(error)))
+            else:
+                retry.append(row["id"])
+        try:
+            await complete_outbox(self._pool, sent, retry, failed, RETRY_DELAY)
+        except Exception as e:
+            # Статус не записан: по истечении аренды пачка уйдет повторно
+            logger.error(f"Outbox: failed to record results of {len(batch)} messages: {e}")
+            return
+        outbox_messages_total.inc(len(sent), status="sent")
+        outbox_messages_total.inc(len(retry), status="retry")
+        outbox_messages_total.inc(len(failed), status="failed")
+        logger.info(f"Outbox: {len(sent)} sent, {len(retry)} to retry, {len(failed)} failed")
+
+    async def _send(self, row):
+        try:
+            await self._bot.send_message(chat_id=row["user_id"], text=row["text"])
+        except Exception as e:
+            logger.error(f"Outbox message {row['id']} to user {row['user_id']} failed: {e}")
+            return e
+        lag = datetime.datetime.now(datetime.timezone.utc) - row["created_at"]
+        outbox_lag_seconds.observe(lag.total_seconds(), kind=row["kind"])
+        return None
+
+    async def _report_depth(self):
+        while not self._closed:
+            try:
+                outbox_depth.set(await get_outbox_depth(self._pool))
+            except Exception as e:
+                logger.error(f"Outbox: failed to read queue depth: {e}")
+            await asyncio.sleep(DEPTH_INTERVAL)
+
+    async def close(self):
+        self._closed = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+outbox = OutboxWorker()
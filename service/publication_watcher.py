@@ -0,0 +1,106 @@
+import datetime
+import os
+
+from apscheduler.triggers.date import DateTrigger
+
+from logger.logging_settings import logger
+from service.cbr_client import cbr_client
+
+# ЦБ устанавливает курсы на следующую дату по рабочим дням; в это окно (часы по
+# времени планировщика) фид опрашивается часто, в остальное время — редко
+WINDOW_START = int(os.getenv("CBR_WINDOW_START", 11))
+WINDOW_END = int(os.getenv("CBR_WINDOW_END", 18))
+FAST_INTERVAL = int(os.getenv("CBR_WATCH_FAST", 60))
+SLOW_INTERVAL = int(os.getenv("CBR_WATCH_SLOW", 3600))
+
+JOB_ID = "publication_watcher"
+
+
+def next_poll(now, published):
+    """
+    Время следующего опроса фида.
+
+    Args:
+        now: Текущее время (aware datetime в часовом поясе планировщика).
+        published: Курсы на следующую дату уже опубликованы.
+
+    Returns:
+        datetime: Через FAST_INTERVAL в окне публикации рабочего дня, пока курсы
+        еще не вышли; иначе начало следующего окна, но не позже чем через SLOW_INTERVAL.
+    """
+    in_window = now.weekday() < 5 and WINDOW_START <= now.hour < WINDOW_END
+    if in_window and not published:
+        return now + datetime.timedelta(seconds=FAST_INTERVAL)
+
+    window = now.replace(hour=WINDOW_START, minute=0, second=0, microsecond=0)
+    if window <= now:
+        window += datetime.timedelta(days=1)
+    while window.weekday() >= 5:
+        window += datetime.timedelta(days=1)
+    return min(window, now + datetime.timedelta(seconds=SLOW_INTERVAL))
+
+
+class PublicationWatcher:
+    """
+    Одна задача планировщика, следящая за публикацией курсов ЦБ.
+
+    Опрашивает XML_daily на завтрашнюю дату и, когда атрибут Date сменился,
+    передает новый снимок всем подписанным обработчикам. После каждого опроса
+    сама переназначает себя на время из next_poll.
+    """
+
+    def __init__(self):
+        self.scheduler = None
+        self.last_date = None  # Date последней замеченной публикации (ДД.ММ.ГГГГ)
+        self._handlers = []
+
+    def subscribe(self, handler):
+        """Добавляет корутину handler(snapshot), вызываемую при новой публикации."""
+        self._handlers.append(handler)
+
+    def start(self, scheduler):
+        """Ставит первый опрос сразу после запуска планировщика."""
+        self.scheduler = scheduler
+        self._schedule(datetime.datetime.now(scheduler.timezone))
+
+    def _schedule(self, run_date):
+        self.scheduler.add_job(
+            self.poll,
+            DateTrigger(run_date=run_date),
+            id=JOB_ID,
+            replace_existing=True,
+            # Задача сама планирует следующий опрос: пропустить запуск из-за
+            # опоздания планировщика значит остановить наблюдатель до перезапуска
+            misfire_grace_time=None,
+            coalesce=True
+        )
+
+    async def poll(self):
+        now = datetime.datetime.now(self.scheduler.timezone)
+        tomorrow = (now + datetime.timedelta(days=1)).strftime("%d/%m/%Y")
+        try:
+            snapshot = await cbr_client.get_daily(tomorrow)
+        except Exception as e:
+            logger.error(f"Publication watcher: failed to load rates for {tomorrow}: {e}")
+            self._schedule(now + datetime.timedelta(seconds=FAST_INTERVAL))
+            return
+
+        if snapshot.date and snapshot.date != self.last_date:
+            self.last_date = snapshot.date
+            logger.info(f"New CBR publication: rates for {snapshot.date}")
+            await self.emit(snapshot)
+
+        published = snapshot.date == tomorrow.replace("/", ".")
+        run_date = next_poll(datetime.datetime.now(self.scheduler.timezone), published)
+        self._schedule(run_date)
+        logger.debug(f"Publication watcher: next poll at {run_date:%d.%m %H:%M}")
+
+    async def emit(self, snapshot):
+        for handler in self._handlers:
+            try:
+                await handler(snapshot)
+            except Exception as e:
+                logger.error(f"Publication handler {handler} failed: {e}")
+
+
+publication_watcher = PublicationWatcher()
@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import plotly.graph_objects as go
+
+from service.downsample import downsample
+from service.series import RateSeries
+
+# Количество процессов, рисующих графики
+RENDER_WORKERS = int(os.getenv("CHART_RENDER_WORKERS", os.cpu_count() or 2))
+
+_render_pool = None
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    """Пул процессов для отрисовки графиков, создается при первом обращении."""
+    global _render_pool
+    if _render_pool is None:
+        # spawn: дочерний процесс не наследует потоки и блокировки бота
+        _render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS,
+                                           mp_context=multiprocessing.get_context("spawn"))
+    return _render_pool
+
+
+def shutdown_render_pool():
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(cancel_futures=True)
+        _render_pool = None
+
+
+def render_chart(names_str, entries, start_year, end_year, file_path, max_points=None):
+    """
+    Рисует график одной группы валют и сохраняет его в HTML.
+    Выполняется в процессе пула, поэтому принимает только простые типы и массивы NumPy;
+    прореживание тоже выполняется здесь, а не в цикле событий бота.
+
+    Args:
+        names_str: Валюты группы через запятую (для заголовка).
+        entries: Список (валюта, год, даты, курсы) — по линии на каждый год.
+        start_year: Год начала периода.
+        end_year: Год конца периода.
+        file_path: Куда сохранить HTML.
+        max_points: Предел точек на линию (None — без прореживания).
+
+    Returns:
+        str: file_path.
+    """
+    fig = go.Figure()
+
+    for name, year, dates, values in entries:
+        if max_points is not None:
+            year_data = downsample(RateSeries(dates, values), max_points)
+            dates, values = year_data.dates, year_data.values
+        fig.add_trace(go.Scatter(
+            x=dates,
+            y=values,
+            mode='lines',
+            name=f'{name} - {year}',
+            hoverinfo='y+text',
+            text=f'{name}'
+        ))
+
+    fig.update_layout(
+        title=f'{names_str}: Курсы валют с {start_year} по {end_year} год',
+        xaxis_title='Дата',
+        yaxis_title='Курс',
+        xaxis=dict(
+            tickformat='%d.%m.%y',
+            tickangle=45
+        ),
+        hovermode='x',
+        showlegend=False
+    )
+
+    fig.write_html(file_path)  # Сохраняем HTML
+    return file_path
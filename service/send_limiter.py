@@ -0,0 +1,154 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from logger.logging_settings import logger
+from service.metrics import Counter, Histogram
+
+# Бюджеты Telegram: около 30 сообщений в секунду на бота и около одного в секунду в чат
+GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 30))
+CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", 3))
+MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", 3))  # Повторы одного запроса после 429
+MAX_CHAT_BUCKETS = 10000
+
+# Меньше — раньше: ответы пользователям обгоняют рассылку в общей очереди
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BROADCAST = 1
+
+# Приоритет отправок текущей задачи; рассылка выставляет PRIORITY_BROADCAST перед запуском отправителей
+send_priority = ContextVar("send_priority", default=PRIORITY_INTERACTIVE)
+
+send_wait_seconds = Histogram(
+    "telegram_send_wait_seconds", "Ожидание отправки в ограничителе",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 30, 120),
+)
+flood_waits_total = Counter("telegram_flood_waits_total", "Ответы 429 (retry_after) от Telegram")
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity про запас."""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Сколько секунд ждать до появления токена (0, если он уже есть)."""
+        self._refill()
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class SendLimiter:
+    """
+    Ограничитель исходящих сообщений бота.
+
+    Сначала запрос ждет токен своего чата, затем встает в общую очередь с
+    приоритетом; единственный диспетчер выдает глобальные токены по порядку
+    (priority, время постановки). После 429 вся выдача приостанавливается на retry_after.
+    """
+
+    def __init__(self, rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(rate, max(1, int(rate)))
+        self._chats = {}  # {chat_id: TokenBucket}
+        self._waiters = []  # Куча (priority, seq, future)
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._dispatcher = None
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                # Полные ведра ничем не отличаются от новых, их можно забыть
+                self._chats = {key: value for key, value in self._chats.items() if not value.full()}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def acquire(self, chat_id, priority=PRIORITY_INTERACTIVE):
+        started = time.monotonic()
+        bucket = self._chat_bucket(chat_id)
+        while (delay := bucket.delay()) > 0:
+            await asyncio.sleep(delay)
+        bucket.consume()
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        await future
+        send_wait_seconds.observe(time.monotonic() - started,
+                                  priority="broadcast" if priority == PRIORITY_BROADCAST else "interactive")
+
+    async def _dispatch(self):
+        while self._waiters:
+            pause = self._paused_until - time.monotonic()
+            delay = max(pause, self._global.delay())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():  # Ожидающего отменили
+                continue
+            self._global.consume()
+            future.set_result(None)
+
+    def pause(self, seconds):
+        """Приостанавливает выдачу токенов на seconds секунд (retry_after от Telegram)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        # Запас не копится за паузу: после нее токены начинают пополняться с нуля
+        self._global.tokens = 0
+        self._global.updated = self._paused_until
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: все запросы с chat_id (отправка и правка сообщений)
+    проходят через SendLimiter, а при 429 повторяются после retry_after.
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        priority = send_priority.get()
+        for attempt in range(MAX_RETRIES + 1):
+            await self.limiter.acquire(chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                flood_waits_total.inc()
+                self.limiter.pause(e.retry_after)
+                if attempt == MAX_RETRIES:
+                    raise
+                logger.warning(f"Telegram flood wait {e.retry_after} s on {type(method).__name__} to {chat_id}")
+
+
+send_limiter = SendLimiter()
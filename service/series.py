@@ -0,0 +1,48 @@
+import numpy as np
+
+
+class RateSeries:
+    """
+    Ряд курсов одной валюты.
+
+    Даты (datetime64[D]) и значения (float64) хранятся в двух непрерывных
+    отсортированных массивах; выборка по периоду — бинарный поиск и срез без копирования.
+    """
+    __slots__ = ("dates", "values")
+
+    def __init__(self, dates, values):
+        self.dates = np.asarray(dates, dtype="datetime64[D]")
+        self.values = np.asarray(values, dtype=np.float64)
+
+    @classmethod
+    def from_records(cls, records):
+        """Создает ряд из пар (дата, значение курса), отсортированных по дате."""
+        if not records:
+            return cls.empty()
+        dates, values = zip(*records)
+        return cls(dates, values)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype="datetime64[D]"), np.empty(0, dtype=np.float64))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def between(self, start, end):
+        """Срез ряда за даты start..end включительно (datetime.date или datetime64)."""
+        left = np.searchsorted(self.dates, np.datetime64(start, "D"), side="left")
+        right = np.searchsorted(self.dates, np.datetime64(end, "D"), side="right")
+        return RateSeries(self.dates[left:right], self.values[left:right])
+
+    def years(self, start_year, end_year):
+        """Срез ряда за годы start_year..end_year включительно."""
+        return self.between(np.datetime64(f"{start_year}-01-01"), np.datetime64(f"{end_year}-12-31"))
+
+    def min(self):
+        return float(self.values.min()) if len(self) else None
+
+    @property
+    def last_date(self):
+        """Последняя дата ряда (datetime.date) или None для пустого ряда."""
+        return self.dates[-1].item() if len(self) else None
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import plotly
+from plotly.offline import get_plotlyjs
+
+from service.CbRF import SAVE_PATH
+from service.chart_backend import chart_url, publisher
+
+project_root = Path(__file__).resolve().parent.parent
+VIEWER_TEMPLATE = project_root / 'web/viewer.html'
+
+VIEWER_DIR = "viewer"  # static/viewer: страница просмотра и plotly.js
+DATA_DIR = "data"  # static/data/<код валюты>/<год>.json
+PLOTLY_BUNDLE = f"plotly-{plotly.__version__}.min.js"
+
+
+def shard_bytes(code, year, series):
+    """Курсы валюты за один год в компактном JSON."""
+    shard = {
+        "code": code,
+        "year": year,
+        "dates": np.datetime_as_string(series.dates, unit="D").tolist(),
+        "values": np.round(series.values, 4).tolist(),
+    }
+    return json.dumps(shard, separators=(",", ":")).encode("utf-8")
+
+
+def write_if_changed(path, data):
+    """Записывает файл, только если содержимое изменилось. Возвращает True при записи."""
+    path = Path(path)
+    try:
+        if path.read_bytes() == data:
+            return False
+    except FileNotFoundError:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+    return True
+
+
+def ensure_viewer(save_path=SAVE_PATH):
+    """Кладет в static/ страницу просмотра и plotly.js. Возвращает записанные файлы."""
+    viewer_dir = Path(save_path) / VIEWER_DIR
+    written = []
+
+    bundle_path = viewer_dir / PLOTLY_BUNDLE
+    if not bundle_path.is_file():
+        write_if_changed(bundle_path, get_plotlyjs().encode("utf-8"))
+        written.append(bundle_path)
+
+    page = VIEWER_TEMPLATE.read_text(encoding="utf-8").replace("{{PLOTLY_BUNDLE}}", PLOTLY_BUNDLE)
+    index_path = viewer_dir / "index.html"
+    if write_if_changed(index_path, page.encode("utf-8")):
+        written.append(index_path)
+    return written
+
+
+def write_shards(code, series, start_year, end_year, save_path=SAVE_PATH):
+    """Обновляет годовые файлы валюты за период. Возвращает измененные файлы."""
+    written = []
+    for year in range(start_year, end_year + 1):
+        year_data = series.years(year, year)
+        if not len(year_data):
+            continue
+        path = Path(save_path) / DATA_DIR / code / f"{year}.json"
+        if write_if_changed(path, shard_bytes(code, year, year_data)):
+            written.append(path)
+    return written
+
+
+def viewer_url(codes, start_year, end_year):
+    return chart_url(f"{VIEWER_DIR}/index.html?c={','.join(codes)}&from={start_year}&to={end_year}")
+
+
+async def graf_shards(currencies, start_year, end_year):
+    """
+    То же, что graf_mobile, но в компактном формате: вместо HTML с plotly.js
+    на каждый график — ссылка на общую страницу просмотра, которая сама загружает
+    нужные годы из static/data/. Отрисовки на стороне бота нет, публикуются
+    только изменившиеся годовые файлы (обычно один — текущий год).
+
+    Args:
+        currencies: Список валют с данными о курсах (RateSeries) и группой.
+        start_year: Год начала периода.
+        end_year: Год конца периода.
+
+    Returns:
+        list: Как у graf_mobile; 'check_url' — файл, доступность которого нужно дождаться.
+    """
+    written = await asyncio.to_thread(ensure_viewer)
+    groups = {}
+    for currency in currencies:
+        if not len(currency['value']):
+            continue
+        written += await asyncio.to_thread(write_shards, currency['name'], currency['value'],
+                                           start_year, end_year)
+        groups.setdefault(currency['group'], []).append(currency['name'])
+
+    results = await asyncio.gather(*(publisher.publish(os.path.abspath(path)) for path in written))
+    published = all(results)
+
+    charts = []
+    for group, names in sorted(groups.items()):
+        names_sorted = sorted(names)
+        url = viewer_url(names_sorted, start_year, end_year)
+        chart = {'names': ', '.join(names_sorted), 'url': url,
+                 'published': published, 'live': published and publisher.live}
+        # Страница уже может быть доступна, а новые данные еще публикуются
+        group_written = [path for path in written if path.parent.name in names]
+        if group_written:
+            chart['check_url'] = chart_url(Path(os.path.relpath(group_written[-1], SAVE_PATH)).as_posix())
+        charts.append(chart)
+    return charts
@@ -0,0 +1,128 @@
+import datetime
+import os
+import xml.etree.ElementTree as ET
+from abc import ABC, abstractmethod
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:  # lxml не обязателен
+    lxml_etree = None
+
+from logger.logging_settings import logger
+
+# etree (по умолчанию) или lxml. На ответах ЦБ lxml расходует меньше памяти,
+# но медленнее из-за findtext — см. benchmarks/xml_parse.py
+XML_BACKEND = os.getenv("CBR_XML_BACKEND", "etree")
+
+
+def _use_lxml(backend=None):
+    if (backend or XML_BACKEND) != "lxml":
+        return False
+    if lxml_etree is None:
+        raise RuntimeError("CBR_XML_BACKEND=lxml, но lxml не установлен")
+    return True
+
+
+def _parse_date(date_str):
+    """ДД.ММ.ГГГГ -> datetime.date без strptime."""
+    return datetime.date(int(date_str[6:10]), int(date_str[3:5]), int(date_str[0:2]))
+
+
+def _parse_number(text):
+    return float(text.replace(',', '.'))
+
+
+class _RecordStream(ABC):
+    """
+    Инкрементальный разбор XML ЦБ: байты подаются через feed() по мере чтения ответа,
+    готовые записи возвращаются сразу, а разобранные элементы удаляются из дерева,
+    поэтому память не растет с размером документа.
+    """
+    record_tag = None
+
+    def __init__(self, backend=None):
+        if _use_lxml(backend):
+            # lxml отбирает события записей на стороне C, корень — родитель первой записи
+            self._parser = lxml_etree.XMLPullParser(events=("end",), tag=self.record_tag)
+        else:
+            self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._root = None
+        self.root_attrib = {}
+
+    def feed(self, chunk):
+        self._parser.feed(chunk)
+        return self._read_events()
+
+    def close(self):
+        root = self._parser.close()  # lxml возвращает корень, xml.etree — None
+        records = self._read_events()
+        if self._root is None and root is not None:
+            self.root_attrib = dict(root.attrib)
+        return records
+
+    def _read_events(self):
+        records = []
+        for event, element in self._parser.read_events():
+            if event == "start":
+                if self._root is None:
+                    self._set_root(element)
+                continue
+            if element.tag != self.record_tag:
+                continue
+            if self._root is None:
+                self._set_root(element.getparent())
+            record = self._record(element)
+            if record is not None:
+                records.append(record)
+            # Освобождаем разобранные записи: корень остается пустым
+            self._root.clear()
+        return records
+
+    def _set_root(self, element):
+        self._root = element
+        self.root_attrib = dict(element.attrib)
+
+    @abstractmethod
+    def _record(self, element):
+        """Запись из элемента record_tag или None, если элемент пропускается."""
+
+
+class DynamicStream(_RecordStream):
+    """Записи XML_dynamic: (дата, курс за единицу)."""
+    record_tag = "Record"
+
+    def _record(self, element):
+        date_str = element.get("Date")
+        try:
+            value = _parse_number(element.findtext("Value")) / float(element.findtext("Nominal"))
+            return _parse_date(date_str), value
+        except Exception as e:
+            logger.error(f"Некорректная запись {date_str}: {e}")
+            return None
+
+
+class DailyStream(_RecordStream):
+    """Записи XML_daily: (ID, название, код, значение, номинал); дата публикации — root_attrib['Date']."""
+    record_tag = "Valute"
+
+    def _record(self, element):
+        return (
+            element.get("ID"),
+            element.findtext("Name"),
+            element.findtext("CharCode"),
+            _parse_number(element.findtext("Value")),
+            float(element.findtext("Nominal")),
+        )
+
+
+def parse_dynamic(xml_data, backend=None):
+    """Разбирает XML_dynamic целиком и возвращает список (дата, курс)."""
+    stream = DynamicStream(backend)
+    return stream.feed(xml_data) + stream.close()
+
+
+def parse_daily(xml_data, backend=None):
+    """Разбирает XML_daily целиком и возвращает (дата публикации, список записей)."""
+    stream = DailyStream(backend)
+    records = stream.feed(xml_data) + stream.close()
+    return stream.root_attrib.get("Date"), records
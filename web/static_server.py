@@ -0,0 +1,124 @@
+import asyncio
+import gzip
+import os
+import re
+from pathlib import Path
+
+from aiohttp import web
+
+from logger.logging_settings import logger
+from service.metrics import render_metrics
+
+try:
+    import brotli
+except ImportError:  # brotli не обязателен, без него отдаем только gzip
+    brotli = None
+
+project_root = Path(__file__).resolve().parent.parent
+STATIC_DIR = project_root / 'static'
+
+# По умолчанию сервер доступен только локально (обратному прокси, сборщику метрик на той же машине);
+# в контейнере для проброса порта нужен CHART_SERVER_HOST=0.0.0.0
+SERVER_HOST = os.getenv("CHART_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("CHART_SERVER_PORT", 8080))
+# Имя графика содержит ключ данных (service/chart_cache.py), а имя plotly.js — версию,
+# поэтому такие файлы по ссылке никогда не меняются и браузер может хранить их сколько угодно
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+# Страница просмотра и годовые файлы данных (service/shards.py) обновляются на месте:
+# браузер каждый раз сверяет ETag и получает 304, если файл не изменился
+CACHE_REVALIDATE = "public, no-cache"
+
+# Путь внутри static/: сегменты из букв, цифр, '_', '-', '.', не начинающиеся с точки
+FILE_PATH = re.compile(r"^[\w-][\w.-]*(/[\w-][\w.-]*)*$")
+IMMUTABLE_PATH = re.compile(r"^([\w.-]+\.html|viewer/plotly-[\w.-]+\.js)$")
+
+
+def compressed_paths(file_path):
+    """Пути сжатых копий файла, которые может отдать сервер."""
+    return [f"{file_path}.gz", f"{file_path}.br"]
+
+
+def precompress(file_path):
+    """
+    Сохраняет рядом с графиком сжатые копии .gz и .br (если установлен brotli).
+    aiohttp сам выбирает копию по Accept-Encoding клиента, и на каждый запрос
+    ничего не сжимается заново.
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read()
+
+    variants = [(f"{file_path}.gz", gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((f"{file_path}.br", brotli.compress(data, mode=brotli.MODE_TEXT)))
+
+    for path, payload in variants:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+    return file_path
+
+
+async def serve_chart(request):
+    """Отдает файл из static/ со сжатием, ETag и заголовками кэширования."""
+    file_path = request.match_info['file_path']
+    if not FILE_PATH.match(file_path):
+        raise web.HTTPNotFound()
+
+    path = request.app['static_dir'] / file_path
+    if not path.is_file():
+        raise web.HTTPNotFound()
+
+    cache_control = CACHE_IMMUTABLE if IMMUTABLE_PATH.match(file_path) else CACHE_REVALIDATE
+    # FileResponse сам выставляет ETag/Last-Modified, отвечает 304 на If-None-Match
+    # и подставляет file.br / file.gz, если клиент их принимает
+    return web.FileResponse(path, headers={'Cache-Control': cache_control})
+
+
+async def serve_metrics(request):
+    return web.Response(text=render_metrics(), content_type='text/plain')
+
+
+def create_app(static_dir=STATIC_DIR, serve_static=True):
+    """
+    Приложение сервера: /metrics и, если serve_static, файлы static/.
+
+    С публикацией на GitHub Pages (serve_static=False) сервер нужен только для метрик.
+    """
+    app = web.Application()
+    app['static_dir'] = Path(static_dir)
+    if serve_static:
+        # Тот же путь, что и на GitHub Pages: <адрес>/static/<файл>
+        app.router.add_get('/static/{file_path:.+}', serve_chart)  # HEAD обрабатывается тем же хендлером
+    app.router.add_get('/metrics', serve_metrics)
+    return app
+
+
+async def start_chart_server(host=SERVER_HOST, port=SERVER_PORT, static_dir=STATIC_DIR, serve_static=True):
+    """Запускает сервер графиков в текущем цикле событий. Возвращает runner для остановки."""
+    runner = web.AppRunner(create_app(static_dir, serve_static), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Сервер графиков запущен на {host}:{port}")
+    return runner
+
+
+class LocalPublisher:
+    """
+    Публикация графиков встроенным сервером: файл доступен по ссылке сразу
+    после записи, остается только подготовить сжатые копии.
+    """
+
+    # Опубликованный файл сразу доступен по ссылке
+    live = True
+
+    async def publish(self, file_path) -> bool:
+        try:
+            await asyncio.to_thread(precompress, file_path)
+        except OSError as e:
+            # Без сжатых копий файл все равно отдается как есть
+            logger.error(f"Не удалось сжать {file_path}: {e}")
+        return True
+
+    async def close(self):
+        pass